@@ -22,6 +22,12 @@ export_settings['training_data_folder'] = '../data/rhossa'
 export_settings['training_data_method'] = 'exact'
 #export_settings['training_data_folder'] = '../data/rhossa_markers/'
 #export_settings['training_data_method'] = 'markers'
+# The profiles are processed in parallel and the results are cached (by
+# default in ~/.snowmicropyn/training_cache), so retraining only processes
+# new or modified profiles. These are the defaults:
+#export_settings['training_workers'] = None # number of processors
+#export_settings['training_cache'] = True
+#export_settings['training_cache_folder'] = None # TRAINING_CACHE_FOLDER
 
 # And we must choose which algorithms to use for the learning process:
 export_settings['scaler'] = 'standard' # pre-processing: data scaling
@@ -37,12 +43,24 @@ classifier = grain_classifier(export_settings)
 # (like the GUI does), but of course we can also just call the methods for it:
 model_file = './trained_model.dat' # output file name
 classifier.save(model_file)
+# Alternatively, the model can be saved as a folder with a manifest and
+# memory-mappable arrays, which loads much faster (e. g. in worker processes).
+# Both can be used as 'trained_input_path' below:
+classifier.save_artifact('./trained_model')
 
 # Validation. Reading the 'score' property will trigger re-using the training
 # data but setting some of it aside to check the prediction against:
 score = classifier.score(percent=True)
 print(f'Score: {score} % of validation data was classified correctly by a Support Vector Machine.')
 
+# For a more reliable estimate we can perform a k-fold cross-validation, and
+# to tune the model we can try different parameters. The folds are processed
+# in parallel and the trained model is not touched by this:
+results = classifier.cross_validate(folds=5)
+print(f'Cross-validation scores: {list(results.score.round(3))}')
+results = classifier.search({'svc__gamma': [1, 10, 100], 'svc__C': [0.1, 1, 10]}, folds=5)
+print(results.groupby(['svc__gamma', 'svc__C']).score.mean())
+
 # Prediction. We want to use the derived values where some Physics are
 # contained as additional information. Also, of course we must use data in the
 # same shape as was used for training. So we load the profile and calculate
@@ -61,6 +79,13 @@ shapes_two = classifier_two.predict(derivs)
 rand_shape = shapes_two[randrange(len(derivs))]
 print(f'Random classified grain shape from 2nd go: "{rand_shape}."')
 
+# For lightweight workers the trained model can be compiled to a predictor
+# that only needs NumPy (scikit-learn is not imported):
+classifier.compile().save('./trained_model.npz')
+from snowmicropyn.ai.numpy_predictor import NumpyPredictor
+predictor = NumpyPredictor.load('./trained_model.npz')
+shapes_three = predictor.predict(derivs)
+
 # Let's try with a different machine learning model:
 export_settings['model'] = 'multinomialnb'
 export_settings['scaler'] = 'minmax'
@@ -68,3 +93,8 @@ export_settings['model_multinomialnb_alpha'] = 1
 bayes_classifier = grain_classifier(export_settings)
 score = bayes_classifier.score(percent=True)
 print(f'Score: {score} % of validation data was classified correctly by a Naive Bayes classifier.')
+
+# Naive Bayes models can learn new profiles without retraining from scratch.
+# Profiles the model already knows are skipped, so after adding new pits to
+# the training data folder it's enough to call:
+bayes_classifier.update()
@@ -18,6 +18,7 @@ with open(readme_rst) as f:
     LONG_DESC = f.read()
 
 DEPENDENCIES = [
+        'lxml',
         'matplotlib >= 2',
         'numpy',
         'pandas >= 0.22',
@@ -70,6 +71,9 @@ setup(
     entry_points={
         'gui_scripts': [
             'pyngui = snowmicropyn.pyngui.app:main'
+        ],
+        'console_scripts': [
+            'pyndetect = snowmicropyn.batch:main'
         ]
     },
 
@@ -4,17 +4,35 @@ to combine them to a full measurement set containing the measured forces and ass
 snow types. It can then apply what it has learned to standalone SMP profiles to estimate
 the grain shapes at each data point.
 """
+import snowmicropyn
 from snowmicropyn import loewe2012, derivatives, Profile
+from snowmicropyn.ai.numpy_predictor import NumpyPredictor
 from snowmicropyn.match import assimilate_grainshape
 from snowmicropyn.parameterizations.proksch2015 import Proksch2015
 from snowmicropyn.serialize.caaml import preprocess_lowlevel
+from concurrent.futures import ProcessPoolExecutor
+import copy
+import datetime
+import hashlib
+import itertools
+import json
 import logging
+import numpy as np
+import os
 import pandas as pd
 from pandas.api.types import is_string_dtype
 from pandas.api.types import is_numeric_dtype
 import pathlib
 import pickle
+from scipy.ndimage import gaussian_filter
+import tempfile
+import threading
+import time
+import sklearn
+from sklearn.base import clone
 from sklearn.linear_model import LinearRegression
+from sklearn.model_selection import KFold
+from sklearn.model_selection import StratifiedKFold
 from sklearn.model_selection import train_test_split
 from sklearn.naive_bayes import GaussianNB
 from sklearn.naive_bayes import MultinomialNB
@@ -25,6 +43,70 @@ from sklearn.svm import SVC
 
 log = logging.getLogger('snowmicropyn')
 
+_TRAINING_CACHE_VERSION = 1 # increase when the content of cached feature frames changes
+
+#: Default folder for cached training data. Cache files are named by the content of
+#: the profiles' files, so profiles of all training data folders can share it.
+TRAINING_CACHE_FOLDER = pathlib.Path.home() / '.snowmicropyn' / 'training_cache'
+
+# Settings that change the trained model or its predictions:
+_CLASSIFIER_SETTINGS = ('use_pretrained_model', 'trained_input_path', 'training_data_folder',
+    'training_data_method', 'scaler', 'model', 'model_svc_gamma', 'model_multinomialnb_alpha',
+    'remove_negative_data', 'remove_noise', 'noise_threshold', 'smoothing')
+_classifier_cache = {}
+_classifier_cache_lock = threading.Lock()
+
+_ARTIFACT_FORMAT_VERSION = 1 # increase when the layout of model artifacts changes
+_ARTIFACT_MANIFEST = 'manifest.json'
+_ARTIFACT_PIPELINE = 'pipeline.pkl' # pipeline without its large arrays
+
+def _file_digest(path):
+    """SHA-1 of a file's content, empty string if the file does not exist."""
+    digest = hashlib.sha1()
+    try:
+        with open(path, 'rb') as ff:
+            for chunk in iter(lambda: ff.read(1 << 20), b''):
+                digest.update(chunk)
+    except FileNotFoundError:
+        return ''
+    return digest.hexdigest()
+
+def _training_cache_key(pnt_file, method, window_size, overlap):
+    """Cache key for the training data of a single profile.
+
+    It covers everything the features depend on: the pnt file, the ini file
+    (markers) and the CAAML file (manual layers) as well as the moving window
+    settings and the matching method.
+    """
+    parts = [str(_TRAINING_CACHE_VERSION), method, repr(float(window_size)), repr(float(overlap))]
+    parts += [_file_digest(pnt_file.with_suffix(ext)) for ext in ('.pnt', '.ini', '.caaml')]
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()
+
+def _training_file_data(pnt_file, method, window_size, overlap):
+    """Derivatives of a single profile with the grain shape column added."""
+    pro = Profile.load(str(pnt_file))
+    derivs = loewe2012.calc(pro._samples, window_size, overlap)
+    return assimilate_grainshape(derivs, pro, method) # insert "grain_shape" column
+
+_cv_data = None # unfitted pipeline, training arrays and folds of a cross-validation worker process
+
+def _cv_init(pipe, XX, yy, splits):
+    """Hand the pipeline template, the training arrays and the folds to a worker
+    process once instead of with every task."""
+    global _cv_data
+    _cv_data = (pipe, XX, yy, splits)
+
+def _cv_fold(params, fold):
+    """Fit a copy of the pipeline on one fold and score it on the rest."""
+    pipe, XX, yy, splits = _cv_data
+    train, test = splits[fold]
+    model = clone(pipe).set_params(**params)
+    start = time.perf_counter()
+    model.fit(XX[train], yy[train])
+    fitted = time.perf_counter()
+    score = model.score(XX[test], yy[test])
+    return score, fitted - start, time.perf_counter() - fitted
+
 class grain_classifier:
     """This object offers an interface to a machine learning workflow. It can either be initialized
     from a saved trained model state, in which case the pre-trained model will be applied to a
@@ -41,6 +123,8 @@ class grain_classifier:
     _index_codes = None # for when numeric indices must be used for the grain shape
     _index_labels = None
     _init_from_pickle = False # flag for how the class was initialized / which info we have
+    _manifest = None # manifest of a loaded model artifact
+    _trained_keys = None # training cache keys of the profiles the model has learned (if known)
 
     # pipeline objects:
     _scaler = None
@@ -67,8 +151,8 @@ class grain_classifier:
             if not 'training_data_folder' in self._set:
                 raise ValueError('Grain classification: To fit a model you must supply a training data location via the "training_data_folder" key.')
             # Combine SMP measurements with external information about the involved grain shapes:
-            self._training_data = self.build_training_data(self._set['training_data_folder'], self._set['training_data_method'])
-            self._training_data = preprocess_lowlevel(self._training_data, self._set)
+            self._training_data, keys = self._load_training_data(self._set['training_data_folder'])
+            self._trained_keys = set(keys)
             # Some models (like linear regression) expect numeric values for the parameter to estimate. Create a lookup:
             self._index_codes, self._index_labels = pd.factorize(self._training_data[self._grain_id])
 
@@ -90,32 +174,169 @@ class grain_classifier:
             if not is_numeric_dtype(column.dtype):
                 column = self._index_codes
         else: # make sure it's a string
-            if not is_string_dtype(column.dtype):
-                column = self._index_labels[[int(col) for col in column]]
+            if not is_string_dtype(column.dtype): # round to the nearest valid index
+                column = np.take(np.asarray(self._index_labels), np.rint(column).astype(int), mode='clip')
         return column
 
     @staticmethod
-    def build_training_data(data_folder: str, method: str):
+    def build_training_data(data_folder: str, method: str, workers=None, cache=True, cache_folder=None):
         """Loads an SMP profile and an associated CAAML (manual) profile, calculates
         the derivatives and adds a column with the grain shape taken from the CAAML.
 
+        The profiles are processed by a pool of worker processes. The result of each
+        profile is cached, so that only new or modified profiles are processed again
+        the next time.
+
         param data_folder: Folder with a collection of matching SMP and CAAML profiles.
         param method: Format of training dataset / method of parsing. Can be one of the
         following:
           'exact': Finds the grain shape in a CAAML with the same base file name.
+          'dtw': Like 'exact', but aligns the depths of both profiles by dynamic time warping.
           'markers': Finds the grain shape from markers in the SMP profile.
+        param workers: Number of worker processes. None uses the number of processors,
+        1 processes the profiles in the current process.
+        param cache: Set to False to neither read nor write the cache.
+        param cache_folder: Location of the cache. Defaults to
+        :const:`TRAINING_CACHE_FOLDER`. If it can not be written to, training
+        continues without the cache.
         returns: Pandas dataframe with the grain shape added to the SMP data.
         """
+        frames, _ = grain_classifier._build_training_frames(sorted(pathlib.Path(data_folder).rglob('*.pnt')),
+            method, workers, cache, cache_folder or TRAINING_CACHE_FOLDER)
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames) # put all training data in single container
+
+    @staticmethod
+    def _build_training_frames(profiles, method, workers, cache, cache_folder):
+        """Training data of each profile, see :meth:`build_training_data`.
+
+        returns: List of pandas dataframes and list of cache keys, one per profile.
+        """
         proksch = Proksch2015() # Fetch Löwe's moving window properties from here
-        profiles = pathlib.Path(data_folder).rglob('*.pnt')
-        data = pd.DataFrame()
-        for file in profiles:
-            pnt = str(file.resolve())
-            pro = Profile.load(pnt)
-            derivs = loewe2012.calc(pro._samples, proksch.window_size, proksch.overlap)
-            matched = assimilate_grainshape(derivs, pro, method) # insert "grain_shape" column
-            data = pd.concat([data, matched]) # put all training data in single container
-        return data
+        window_size, overlap = proksch.window_size, proksch.overlap
+        cache_folder = pathlib.Path(cache_folder)
+
+        frames = [None] * len(profiles)
+        keys = [_training_cache_key(file, method, window_size, overlap) for file in profiles]
+        if cache:
+            for ii, key in enumerate(keys):
+                cache_file = cache_folder / (key + '.pkl')
+                if cache_file.is_file():
+                    try:
+                        frames[ii] = pd.read_pickle(cache_file)
+                    except Exception as e: # a broken cache file is simply replaced
+                        log.warning(f'Could not read training data cache file "{cache_file}": {e}')
+
+        todo = [ii for ii, frame in enumerate(frames) if frame is None]
+        log.info(f'Building training data from {len(profiles)} profiles ({len(profiles) - len(todo)} cached)')
+        files = [profiles[ii].resolve() for ii in todo]
+        if workers == 1 or len(todo) < 2:
+            results = [_training_file_data(file, method, window_size, overlap) for file in files]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(_training_file_data, files, [method] * len(todo),
+                    [window_size] * len(todo), [overlap] * len(todo)))
+
+        for ii, matched in zip(todo, results):
+            frames[ii] = matched
+        if cache and todo:
+            try:
+                cache_folder.mkdir(parents=True, exist_ok=True)
+                for ii in todo: # write atomically, parallel training runs may share the cache
+                    fd, tmp_name = tempfile.mkstemp(dir=cache_folder, suffix='.tmp')
+                    os.close(fd)
+                    try:
+                        frames[ii].to_pickle(tmp_name)
+                        os.replace(tmp_name, cache_folder / (keys[ii] + '.pkl'))
+                    finally:
+                        if os.path.exists(tmp_name):
+                            os.remove(tmp_name)
+            except OSError as e: # e. g. a read-only folder, training works without the cache
+                log.warning(f'Could not write training data cache to "{cache_folder}": {e}')
+        return frames, keys
+
+    def _load_training_data(self, source):
+        """Pre-processed training data of a folder or of a list of pnt files, and
+        the cache keys of the profiles."""
+        if isinstance(source, (str, os.PathLike)):
+            profiles = sorted(pathlib.Path(source).rglob('*.pnt'))
+        else:
+            profiles = sorted(pathlib.Path(pp) for pp in source)
+        frames, keys = self._build_training_frames(profiles, self._set['training_data_method'],
+            self._set.get('training_workers'), self._set.get('training_cache', True),
+            self._set.get('training_cache_folder') or TRAINING_CACHE_FOLDER)
+        data = pd.concat(frames) if frames else pd.DataFrame()
+        return preprocess_lowlevel(data, self._set), keys
+
+    def update(self, source=None):
+        """Incrementally train the model with additional profiles. This is available for the
+        naive Bayes models ('gaussiannb' and 'multinomialnb') and takes time proportional to
+        the new data only. Profiles the model has already learned are skipped (they are
+        recognized by the content of their files).
+
+        The scaler statistics are updated as running statistics and the learned model
+        parameters are transformed to the new scaling, so the result is the same as
+        training on all data at once. New data must not contain grain shapes the model
+        has never seen. The model is saved afterwards if the 'save_model' setting is set.
+
+        param source: Folder with training data (default: the 'training_data_folder'
+        setting) or list of pnt files.
+        returns: Number of profiles that were learned.
+        """
+        scaler = self._pipe.steps[0][1]
+        model = self._pipe.steps[-1][1]
+        if not isinstance(model, (GaussianNB, MultinomialNB)):
+            raise ValueError('Grain classification: Only naive Bayes models can be trained incrementally.')
+        if source is None:
+            source = self._set['training_data_folder']
+        if isinstance(source, (str, os.PathLike)):
+            source = sorted(pathlib.Path(source).rglob('*.pnt'))
+        if self._trained_keys is None:
+            log.warning('The profiles a pre-trained model has learned are unknown, all given profiles are learned')
+            self._trained_keys = set()
+        proksch = Proksch2015()
+        keys = [_training_cache_key(pathlib.Path(pp), self._set['training_data_method'], proksch.window_size, proksch.overlap)
+            for pp in source]
+        new = [pp for pp, key in zip(source, keys) if key not in self._trained_keys]
+        log.info(f'Updating model with {len(new)} new profiles')
+        if not new:
+            return 0
+        data, new_keys = self._load_training_data(new)
+        XX = data.drop([self._grain_id], axis=1)
+        yy = data[self._grain_id]
+        unknown = set(yy) - set(model.classes_)
+        if unknown:
+            raise ValueError(f'Grain classification: The grain shapes {sorted(unknown)} are new to the model, it must be trained from scratch.')
+        for estimator in (scaler, model): # arrays of a loaded artifact are read-only memory maps
+            for attr, value in list(vars(estimator).items()):
+                if isinstance(value, np.ndarray) and not value.flags.writeable:
+                    setattr(estimator, attr, np.array(value))
+
+        # Scaled features are an affine function a * x + b of the raw ones
+        if isinstance(scaler, StandardScaler):
+            affine = lambda: (1 / scaler.scale_, -scaler.mean_ / scaler.scale_)
+        else:
+            affine = lambda: (scaler.scale_, scaler.min_)
+        old_a, old_b = affine()
+        scaler.partial_fit(XX)
+        new_a, new_b = affine()
+        aa = new_a / old_a # old scaled features to new scaled features
+        bb = new_b - old_b * aa
+        if isinstance(model, GaussianNB):
+            model.theta_ = model.theta_ * aa + bb
+            model.var_ = (model.var_ - model.epsilon_) * aa ** 2 + model.epsilon_
+        else: # the feature counts are sums of scaled features
+            model.feature_count_ = model.feature_count_ * aa + model.class_count_[:, np.newaxis] * bb
+        model.partial_fit(scaler.transform(XX), yy)
+
+        self._trained_keys.update(new_keys)
+        if not self._init_from_pickle:
+            self._training_data = pd.concat([self._training_data, data])
+        self._score = None
+        if self._set.get('save_model', False) and self._set.get('trained_output_path'):
+            self.save(self._set['trained_output_path'])
+        return len(new)
 
     def split_pro_data(self):
         """Split a full dataset already containing the "grain_shape" column into X and y, i. e.
@@ -184,15 +405,173 @@ class grain_classifier:
         param model_file: Output path for dumping the trained model.
         """
         log.info(f'Saving model state to "{model_file}"')
-        pickle.dump(self._pipe, open(model_file, 'wb'))
+        with open(model_file, 'wb') as ff:
+            pickle.dump(self._pipe, ff)
 
     def load(self, model_file):
         """Load a previously trained model from the file system.
 
-        param model_file: Path to an existing trained model.
+        param model_file: Path to an existing trained model. This can be a file written
+        by :meth:`save` or a folder written by :meth:`save_artifact`.
         """
+        if pathlib.Path(model_file).is_dir():
+            self.load_artifact(model_file)
+            return
         log.info(f'Loading model state from "{model_file}"')
-        self._pipe = pickle.load(open(model_file, 'rb'))
+        with open(model_file, 'rb') as ff:
+            self._pipe = pickle.load(ff)
+
+    def save_artifact(self, folder):
+        """Save the trained model as a folder that can be loaded quickly.
+
+        Large arrays (e. g. the support vectors of a SVC, the scaler statistics and the
+        grain shape labels) are stored as separate NumPy files which are memory-mapped
+        when loading. A manifest lists them along with the versions of snowmicropyn and
+        scikit-learn and a fingerprint of the training data.
+
+        param folder: Output folder. Existing files of an earlier artifact are replaced.
+        """
+        folder = pathlib.Path(folder)
+        log.info(f'Saving model artifact to "{folder}"')
+        folder.mkdir(parents=True, exist_ok=True)
+        (folder / _ARTIFACT_MANIFEST).unlink(missing_ok=True) # the manifest marks a complete artifact
+
+        arrays = {}
+        saved = {} # id of array -> file, estimators may share arrays
+        steps = []
+        for name, estimator in self._pipe.steps:
+            skeleton = copy.copy(estimator)
+            for attr, value in vars(estimator).items():
+                if isinstance(value, np.ndarray) and value.dtype != object:
+                    if id(value) not in saved:
+                        saved[id(value)] = f'{name}.{attr}.npy'
+                        np.save(folder / saved[id(value)], np.ascontiguousarray(value))
+                    arrays[f'{name}.{attr}'] = saved[id(value)]
+                    setattr(skeleton, attr, None)
+            steps.append((name, skeleton))
+        with open(folder / _ARTIFACT_PIPELINE, 'wb') as ff:
+            pickle.dump(Pipeline(steps), ff)
+
+        labels = None
+        if self._index_labels is not None:
+            labels = 'index_labels.npy'
+            np.save(folder / labels, np.asarray(self._index_labels, dtype=str))
+
+        manifest = {
+            'format_version': _ARTIFACT_FORMAT_VERSION,
+            'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'snowmicropyn_version': snowmicropyn.__version__,
+            'sklearn_version': sklearn.__version__,
+            'numpy_version': np.__version__,
+            'steps': [name for name, _ in self._pipe.steps],
+            'numeric_target': self._numeric_target,
+            'index_labels': labels,
+            'arrays': arrays,
+            'training_fingerprint': self._training_fingerprint(),
+            'training_keys': sorted(self._trained_keys) if self._trained_keys is not None else None,
+        }
+        with open(folder / _ARTIFACT_MANIFEST, 'w') as ff:
+            json.dump(manifest, ff, indent=2)
+
+    def load_artifact(self, folder, mmap=True):
+        """Load a model saved with :meth:`save_artifact`.
+
+        param folder: Folder of the artifact.
+        param mmap: Memory-map the arrays instead of reading them. This makes loading
+        almost instant and lets processes share the memory.
+        """
+        folder = pathlib.Path(folder)
+        log.info(f'Loading model artifact from "{folder}"')
+        with open(folder / _ARTIFACT_MANIFEST) as ff:
+            manifest = json.load(ff)
+        if manifest['format_version'] > _ARTIFACT_FORMAT_VERSION:
+            raise ValueError(f'Grain classification: The model artifact "{folder}" was written by a newer version of snowmicropyn.')
+        if manifest['sklearn_version'] != sklearn.__version__:
+            log.warning(f"Model artifact was saved with scikit-learn {manifest['sklearn_version']}, "
+                f'running {sklearn.__version__}')
+
+        with open(folder / _ARTIFACT_PIPELINE, 'rb') as ff:
+            pipe = pickle.load(ff)
+        mmap_mode = 'r' if mmap else None
+        loaded = {}
+        for key, file in manifest['arrays'].items():
+            name, attr = key.split('.', 1)
+            if file not in loaded:
+                loaded[file] = np.load(folder / file, mmap_mode=mmap_mode)
+            setattr(pipe.named_steps[name], attr, loaded[file])
+        self._pipe = pipe
+        self._numeric_target = manifest['numeric_target']
+        if manifest['index_labels']:
+            self._index_labels = pd.Index(np.load(folder / manifest['index_labels']))
+        self._manifest = manifest
+        keys = manifest.get('training_keys')
+        self._trained_keys = set(keys) if keys is not None else None
+
+    def compile(self):
+        """Convert the trained pipeline into a :class:`NumpyPredictor
+        <snowmicropyn.ai.numpy_predictor.NumpyPredictor>`, which predicts without
+        scikit-learn. Supported are the 'standard' and 'minmax' scalers and the
+        models 'gaussiannb', 'multinomialnb', 'lr' and 'svc' (RBF kernel only).
+
+        returns: NumpyPredictor object. Use its save() method to store it.
+        """
+        scaler = self._pipe.steps[0][1]
+        model = self._pipe.steps[-1][1]
+        arrays = {}
+        if isinstance(scaler, StandardScaler):
+            scaler_name = 'standard'
+            if scaler.mean_ is not None:
+                arrays['mean'] = scaler.mean_
+            if scaler.scale_ is not None:
+                arrays['scale'] = scaler.scale_
+        elif isinstance(scaler, MinMaxScaler):
+            scaler_name = 'minmax'
+            arrays['min'] = scaler.min_
+            arrays['scale'] = scaler.scale_
+            if scaler.clip:
+                arrays['clip'] = np.array(scaler.feature_range, dtype=float)
+        else:
+            raise ValueError(f'Grain classification: The scaler {scaler} can not be compiled.')
+
+        if isinstance(model, GaussianNB):
+            model_name = 'gaussiannb'
+            arrays['theta'] = model.theta_
+            arrays['var'] = model.var_
+            arrays['log_norm'] = np.log(model.class_prior_) - 0.5 * np.log(2 * np.pi * model.var_).sum(axis=1)
+        elif isinstance(model, MultinomialNB):
+            model_name = 'multinomialnb'
+            arrays['feature_log_prob'] = model.feature_log_prob_
+            arrays['class_log_prior'] = model.class_log_prior_
+        elif isinstance(model, LinearRegression):
+            model_name = 'lr'
+            arrays['coef'] = model.coef_
+            arrays['intercept'] = np.asarray(model.intercept_)
+        elif isinstance(model, SVC) and model.kernel == 'rbf':
+            model_name = 'svc'
+            arrays['support_vectors'] = model.support_vectors_
+            arrays['sv_sq_norm'] = (model.support_vectors_ ** 2).sum(axis=1)
+            arrays['n_support'] = model._n_support
+            arrays['dual_coef'] = model._dual_coef_
+            arrays['intercept'] = model._intercept_
+            arrays['gamma'] = np.asarray(model._gamma)
+        else:
+            raise ValueError(f'Grain classification: The model {model} can not be compiled.')
+        if hasattr(model, 'classes_'):
+            arrays['classes'] = np.asarray(model.classes_).astype(str)
+
+        if hasattr(scaler, 'feature_names_in_'):
+            features = list(scaler.feature_names_in_)
+        else:
+            features = [col for col in self._training_data.columns if col != self._grain_id]
+        labels = np.asarray(self._index_labels).astype(str) if self._numeric_target else None
+        return NumpyPredictor(scaler_name, model_name, arrays, features, labels, self._set)
+
+    def _training_fingerprint(self):
+        """Hash of the training data (file names, sizes and modification times)."""
+        if self._init_from_pickle:
+            return (self._manifest or {}).get('training_fingerprint')
+        _, fingerprint = _classifier_cache_key(self._set)
+        return hashlib.sha1(repr(fingerprint).encode()).hexdigest()
 
     @property
     def ready(self):
@@ -212,14 +591,88 @@ class grain_classifier:
         if not self._score or recalc:
             XX, yy = self.split_pro_data()
             XX_train, XX_test, yy_train, yy_test = train_test_split(XX, yy)
-            self._pipe.fit(XX_train, yy_train)
-            self._score = self._pipe.score(XX_test, yy_test)
+            pipe = clone(self._pipe) # keep the model trained on all data
+            pipe.fit(XX_train, yy_train)
+            self._score = pipe.score(XX_test, yy_test)
 
         fscore = self._score
         if percent:
             fscore = round(self._score * 100)
         return fscore
 
+    def _run_folds(self, candidates, folds, workers, seed):
+        """Score each parameter set on each fold, see :meth:`cross_validate`."""
+        if self._init_from_pickle:
+            raise ValueError('Grain classification: The model can not be validated since it was initialized as pre-trained.')
+        XX, yy = self.split_pro_data()
+        XX = XX.to_numpy(dtype=float)
+        yy = np.asarray(yy)
+        splitter = KFold if self._numeric_target else StratifiedKFold
+        splits = list(splitter(n_splits=folds, shuffle=True, random_state=seed).split(XX, yy))
+        tasks = [(cc, ff) for cc in range(len(candidates)) for ff in range(len(splits))]
+        params = [candidates[cc] for cc, _ in tasks]
+        fold_numbers = [ff for _, ff in tasks]
+        template = clone(self._pipe) # the workers need the settings only, not the fitted arrays
+        if workers == 1 or len(tasks) < 2:
+            _cv_init(template, XX, yy, splits)
+            results = list(map(_cv_fold, params, fold_numbers))
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_cv_init,
+                    initargs=(template, XX, yy, splits)) as pool:
+                results = list(pool.map(_cv_fold, params, fold_numbers))
+
+        rows = []
+        for (cc, ff), (score, fit_seconds, score_seconds) in zip(tasks, results):
+            rows.append({'candidate': cc, **candidates[cc], 'fold': ff, 'score': score,
+                'fit_seconds': fit_seconds, 'score_seconds': score_seconds})
+        return pd.DataFrame(rows)
+
+    def cross_validate(self, folds=5, params=None, workers=None, seed=None):
+        """k-fold cross-validation of the model. For each fold, a copy of the pipeline is
+        fitted on the remaining folds and scored on the fold itself. The folds are processed
+        by a pool of worker processes. The trained pipeline of this object is not changed.
+
+        param folds: Number of folds.
+        param params: Dictionary of pipeline parameters to change for the validation, named
+        like '<step>__<parameter>', e. g. {'svc__gamma': 10}.
+        param workers: Number of worker processes. None uses the number of processors,
+        1 runs everything in the current process.
+        param seed: Seed for shuffling the data before splitting it into folds.
+        returns: Pandas dataframe with one row per fold and the columns 'candidate', the
+        changed parameters, 'fold', 'score', 'fit_seconds' and 'score_seconds'.
+        """
+        return self._run_folds([params or {}], folds, workers, seed)
+
+    def search(self, param_grid: dict, folds=5, n_iter=None, workers=None, seed=None):
+        """Cross-validate many parameter sets to tune the model. All combinations of
+        the given values are tried (grid search), or only n_iter random ones (random search).
+        All folds of all parameter sets are processed by one pool of worker processes. The
+        trained pipeline of this object is not changed.
+
+        Example: ``search({'svc__gamma': [1, 10, 100], 'svc__C': [0.1, 1, 10]}, n_iter=5)``
+
+        The mean score per parameter set is
+        ``results.groupby('candidate').score.mean()``.
+
+        param param_grid: Dictionary with pipeline parameters ('<step>__<parameter>') as keys
+        and lists of values to try.
+        param folds: Number of folds.
+        param n_iter: Number of random parameter sets to try, None for all.
+        param workers: Number of worker processes, see :meth:`cross_validate`.
+        param seed: Seed for shuffling the data and for picking random parameter sets.
+        returns: Pandas dataframe as returned by :meth:`cross_validate` with the rows of
+        all parameter sets.
+        """
+        names = list(param_grid)
+        candidates = [dict(zip(names, values)) for values in itertools.product(*param_grid.values())]
+        if n_iter is not None and n_iter < len(candidates):
+            picked = np.random.default_rng(seed).choice(len(candidates), size=n_iter, replace=False)
+            candidates = [candidates[ii] for ii in sorted(picked)]
+        results = self._run_folds(candidates, folds, workers, seed)
+        best = results.groupby('candidate').score.mean().idxmax()
+        log.info(f'Best parameters of search: {candidates[best]}')
+        return results
+
     def train(self):
         """Fits the model. This function uses the full dataset for training and therefore does not provide
         a score value - use the .score property separately for this if desired."""
@@ -238,3 +691,71 @@ class grain_classifier:
         yy = self._numeric_data(yy, numeric=False) # convert back to string representation (if necessary)
         return yy
 
+    def predict_many(self, frames):
+        """Predict the grain shapes of many profiles in a single pass. The result is the
+        same as calling :meth:`predict` for each profile, but pre-processing and the model
+        run only once on all rows.
+
+        param frames: Iterable of pandas dataframes with SMP measurements (one per profile).
+        returns: List of numpy arrays with the grain shapes, one per profile.
+        """
+        frames = list(frames)
+        if not frames:
+            return []
+        lengths = [len(frame) for frame in frames]
+        data = pd.concat(frames, ignore_index=True)
+        data['_profile'] = np.repeat(np.arange(len(frames)), lengths)
+        # Smoothing must not spread over profile boundaries, it is done per profile below
+        data = preprocess_lowlevel(data, dict(self._set, smoothing=False))
+        if self._set.get('smoothing', False):
+            data = data.copy()
+            data['force_median'] = data.groupby('_profile').force_median.transform(
+                lambda force: gaussian_filter(force, sigma=0.5))
+        profile = data.pop('_profile').to_numpy()
+
+        yy = self._pipe.predict(data) if len(data) else np.array([])
+        yy = np.asarray(self._numeric_data(yy, numeric=False))
+        return np.split(yy, np.searchsorted(profile, np.arange(1, len(frames))))
+
+
+def _classifier_cache_key(user_settings: dict):
+    """Key for the classifier cache: the relevant settings and a fingerprint of the
+    model file or the training data (file names, sizes and modification times)."""
+    settings = tuple((key, repr(user_settings.get(key))) for key in _CLASSIFIER_SETTINGS)
+    if user_settings.get('use_pretrained_model', False):
+        files = [pathlib.Path(user_settings['trained_input_path'])]
+    else:
+        folder = pathlib.Path(user_settings.get('training_data_folder', ''))
+        files = sorted(ff for ff in folder.rglob('*') if ff.suffix.lower() in ('.pnt', '.ini', '.caaml'))
+    fingerprint = []
+    for ff in files:
+        try:
+            stat = ff.stat()
+            fingerprint.append((str(ff.resolve()), stat.st_size, stat.st_mtime_ns))
+        except FileNotFoundError:
+            fingerprint.append((str(ff), None, None))
+    return settings, tuple(fingerprint)
+
+def cached_classifier(user_settings: dict):
+    """Get a grain classifier for the given settings, reusing one that was created
+    earlier in this process if neither the settings nor the training data (or the
+    pre-trained model file) changed. This way a batch export trains or loads the
+    model only once.
+
+    param user_settings: Dictionary of user settings, see :class:`grain_classifier`.
+    returns: A ready to use :class:`grain_classifier`.
+    """
+    key = _classifier_cache_key(user_settings)
+    with _classifier_cache_lock:
+        classifier = _classifier_cache.get(key)
+        if classifier is None:
+            classifier = grain_classifier(dict(user_settings))
+            _classifier_cache[key] = classifier
+        else:
+            log.info('Reusing grain shape classifier trained earlier')
+    return classifier
+
+def clear_classifier_cache():
+    """Forget all classifiers created by :func:`cached_classifier`."""
+    with _classifier_cache_lock:
+        _classifier_cache.clear()
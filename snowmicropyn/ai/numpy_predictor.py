@@ -0,0 +1,152 @@
+"""Grain shape prediction with plain NumPy.
+
+A pipeline trained by :class:`snowmicropyn.ai.grain_classifier.grain_classifier`
+can be compiled to a :class:`NumpyPredictor` (see
+:meth:`grain_classifier.compile <snowmicropyn.ai.grain_classifier.grain_classifier.compile>`).
+The predictor holds only the arrays needed for inference and does not import
+scikit-learn, so that it starts up fast e. g. in worker processes. Supported
+are the standard and min/max scalers together with Gaussian and multinomial
+naive Bayes, linear regression and support vector machines with RBF kernel.
+"""
+
+import json
+import logging
+
+import numpy as np
+
+from snowmicropyn.serialize.caaml import preprocess_lowlevel
+
+log = logging.getLogger('snowmicropyn')
+
+#: Settings of the low-level pre-processing that are applied before prediction.
+PREPROCESS_SETTINGS = ('remove_negative_data', 'remove_noise', 'noise_threshold', 'smoothing')
+
+
+class NumpyPredictor:
+    """Trained scaler and model as NumPy arrays.
+
+    :param scaler: Scaler type ('standard' or 'minmax').
+    :param model: Model type ('gaussiannb', 'multinomialnb', 'lr' or 'svc').
+    :param arrays: Dictionary of the fitted arrays of scaler and model.
+    :param features: List of feature (column) names in the order of training.
+    :param labels: Grain shape labels if the model predicts numeric indices.
+    :param settings: Dictionary with the pre-processing settings (see
+           :const:`PREPROCESS_SETTINGS`).
+    """
+
+    #: Rows per batch when the memory of a batch grows with the model size (SVC kernel).
+    BATCH_SIZE = 4096
+
+    def __init__(self, scaler, model, arrays, features, labels=None, settings=None):
+        if scaler not in ('standard', 'minmax', None):
+            raise ValueError(f'Scaler "{scaler}" is not supported.')
+        if model not in ('gaussiannb', 'multinomialnb', 'lr', 'svc'):
+            raise ValueError(f'Model "{model}" is not supported.')
+        self.scaler = scaler
+        self.model = model
+        self.arrays = {key: np.asarray(value) for key, value in arrays.items()}
+        self.features = list(features)
+        self.labels = None if labels is None else np.asarray(labels)
+        self.settings = {key: value for key, value in (settings or {}).items() if key in PREPROCESS_SETTINGS}
+
+    def _scale(self, XX):
+        aa = self.arrays
+        if self.scaler == 'standard':
+            if 'mean' in aa:
+                XX = XX - aa['mean']
+            if 'scale' in aa:
+                XX = XX / aa['scale']
+        elif self.scaler == 'minmax':
+            XX = XX * aa['scale'] + aa['min']
+            if 'clip' in aa:
+                XX = np.clip(XX, *aa['clip'])
+        return XX
+
+    def _gaussiannb(self, XX):
+        aa = self.arrays
+        # Joint log likelihood, the constant parts are precomputed by the compiler
+        jll = aa['log_norm'] - 0.5 * (((XX[:, np.newaxis, :] - aa['theta']) ** 2) / aa['var']).sum(axis=2)
+        return aa['classes'][np.argmax(jll, axis=1)]
+
+    def _multinomialnb(self, XX):
+        aa = self.arrays
+        jll = XX @ aa['feature_log_prob'].T + aa['class_log_prior']
+        return aa['classes'][np.argmax(jll, axis=1)]
+
+    def _lr(self, XX):
+        return XX @ self.arrays['coef'].T + self.arrays['intercept']
+
+    def _svc(self, XX):
+        aa = self.arrays
+        sv = aa['support_vectors']
+        # RBF kernel via |x - s|^2 = |x|^2 - 2 x.s + |s|^2
+        sq_dist = (XX ** 2).sum(axis=1)[:, np.newaxis] - 2 * XX @ sv.T + aa['sv_sq_norm']
+        kernel = np.exp(-aa['gamma'] * np.maximum(sq_dist, 0))
+        n_classes = len(aa['classes'])
+        bounds = np.concatenate([[0], np.cumsum(aa['n_support'])])
+        votes = np.zeros((len(XX), n_classes), dtype=int)
+        pair = 0
+        # One-vs-one decisions, voting as in libsvm
+        for ii in range(n_classes):
+            for jj in range(ii + 1, n_classes):
+                si = slice(bounds[ii], bounds[ii + 1])
+                sj = slice(bounds[jj], bounds[jj + 1])
+                dec = kernel[:, si] @ aa['dual_coef'][jj - 1, si] + kernel[:, sj] @ aa['dual_coef'][ii, sj] \
+                    + aa['intercept'][pair]
+                votes[:, ii] += dec > 0
+                votes[:, jj] += dec <= 0
+                pair += 1
+        return aa['classes'][np.argmax(votes, axis=1)]
+
+    def predict_array(self, XX):
+        """Predict from an array of features (no pre-processing).
+
+        :param XX: Numpy array of shape (n, number of features), columns in
+               the order of :attr:`features`.
+        :return: Numpy array of n grain shapes.
+        """
+        XX = self._scale(np.asarray(XX, dtype=float))
+        predict = getattr(self, '_' + self.model)
+        if self.model in ('svc', 'gaussiannb'):
+            parts = [predict(XX[start:start + self.BATCH_SIZE]) for start in range(0, len(XX), self.BATCH_SIZE)]
+            yy = np.concatenate(parts) if parts else predict(XX)
+        else:
+            yy = predict(XX)
+        if self.labels is not None: # numeric model: index to grain shape
+            yy = np.take(self.labels, np.clip(np.rint(yy).astype(int), 0, len(self.labels) - 1))
+        return yy
+
+    def predict(self, samples):
+        """Predict the grain shapes of SMP data the same way as
+        :meth:`grain_classifier.predict <snowmicropyn.ai.grain_classifier.grain_classifier.predict>`.
+
+        :param samples: Pandas dataframe with the derived SMP quantities.
+        :return: Numpy array with one grain shape per (pre-processed) row.
+        """
+        samples = preprocess_lowlevel(samples, self.settings)
+        return self.predict_array(samples[self.features].to_numpy(dtype=float))
+
+    def save(self, file):
+        """Save the predictor to a NumPy ``.npz`` file (no pickle involved).
+
+        :param file: Output file name.
+        """
+        meta = {'scaler': self.scaler, 'model': self.model, 'features': self.features, 'settings': self.settings}
+        arrays = {'array_' + key: value for key, value in self.arrays.items()}
+        if self.labels is not None:
+            arrays['labels'] = self.labels.astype(str)
+        with open(file, 'wb') as ff:
+            np.savez(ff, meta=np.array(json.dumps(meta)), **arrays)
+
+    @classmethod
+    def load(cls, file):
+        """Load a predictor written by :meth:`save`.
+
+        :param file: Input file name.
+        :return: A :class:`NumpyPredictor`.
+        """
+        with np.load(file, allow_pickle=False) as data:
+            meta = json.loads(str(data['meta']))
+            arrays = {key[len('array_'):]: data[key] for key in data.files if key.startswith('array_')}
+            labels = data['labels'] if 'labels' in data.files else None
+        return cls(meta['scaler'], meta['model'], arrays, meta['features'], labels, meta['settings'])
@@ -0,0 +1,145 @@
+"""Alignment of SMP profiles with manual snow pits.
+
+The depth axis of an SMP measurement rarely lines up exactly with the one of
+a manual profile taken next to it: the snowpack settles between the two
+measurements, layers vary in thickness along the slope and the surface may
+not be detected exactly. This module warps one depth axis onto the other with
+dynamic time warping (DTW), comparing the hand hardness of both profiles.
+
+The warping path is restricted to a band around the diagonal (`Sakoe-Chiba
+band <https://doi.org/10.1109/TASSP.1978.1163055>`_), so that time and memory
+grow with the length of the profile times the band width only.
+"""
+
+import logging
+
+import numpy as np
+
+log = logging.getLogger('snowmicropyn')
+
+
+def _band_starts(n, m, width, slope):
+    """First column of the band in each of the n rows of an (n, m) cost matrix."""
+    centers = np.round(np.arange(n) * slope).astype(int)
+    return np.clip(centers - width // 2, 0, m - width)
+
+
+def banded_dtw(x, y, band, open_end=False, slope=None):
+    """Dynamic time warping of two sequences within a Sakoe-Chiba band.
+
+    The local cost is the absolute difference (summed over all columns for
+    multidimensional sequences).
+
+    :param x: Numpy array of shape (n,) or (n, d).
+    :param y: Numpy array of shape (m,) or (m, d).
+    :param band: Half width of the band in elements of y. It is widened if
+           necessary for a path through the band to exist.
+    :param open_end: When ``True``, the path may end anywhere in y, e. g.
+           when x only covers the upper part of y.
+    :param slope: The band is centered on the line ``j = slope * i``. By
+           default it runs from the first to the last element of both
+           sequences. Use 1 for sequences sampled at the same resolution.
+    :return: Tuple (path, cost). The path is a numpy array of shape (k, 2)
+             with pairs of indices into x and y, the cost is the accumulated
+             local cost along the path.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if x.ndim == 1:
+        x = x[:, np.newaxis]
+    if y.ndim == 1:
+        y = y[:, np.newaxis]
+    n, m = len(x), len(y)
+    if n == 0 or m == 0:
+        raise ValueError('Can not align empty sequences.')
+    if slope is None:
+        slope = (m - 1) / max(n - 1, 1)
+    # Consecutive rows must overlap for the path to be continuous
+    min_band = int(np.ceil(slope)) + 1
+    width = min(2 * max(int(band), min_band) + 1, m)
+    starts = _band_starts(n, m, width, slope)
+    cols = starts[:, np.newaxis] + np.arange(width)
+
+    # Local cost for all rows at once, shape (n, width)
+    local = np.abs(x[:, np.newaxis, :] - y[cols]).sum(axis=2)
+
+    acc = np.empty((n, width))
+    acc[0] = np.cumsum(local[0]) # the band of the first row starts at (0, 0)
+    for ii in range(1, n):
+        shift = starts[ii] - starts[ii - 1]
+        prev = np.concatenate([acc[ii - 1], np.full(shift + 1, np.inf)])
+        # Vertical step from (i-1, j) and diagonal step from (i-1, j-1)
+        up = prev[shift:shift + width]
+        diag = np.concatenate([[prev[shift - 1] if shift > 0 else np.inf], prev[shift:shift + width - 1]])
+        entry = local[ii] + np.minimum(up, diag)
+        # Horizontal steps within the row: acc[j] = min(entry[j], acc[j-1] + local[j]),
+        # i. e. a running minimum relative to the running sum of the local costs
+        csum = np.cumsum(local[ii])
+        acc[ii] = np.minimum.accumulate(entry - csum) + csum
+
+    last = width - 1 if not open_end else int(np.argmin(acc[-1]))
+    if not np.isfinite(acc[-1, last]):
+        raise ValueError('No warping path within the band.')
+    cost = acc[-1, last]
+
+    # Trace back from the end
+    path = [(n - 1, cols[-1, last])]
+    ii, kk = n - 1, last
+    while ii > 0 or cols[ii, kk] > 0:
+        candidates = []
+        if ii > 0:
+            shift = starts[ii] - starts[ii - 1]
+            for dj in (1, 0): # diagonal, vertical
+                pk = kk + shift - dj
+                if 0 <= pk < width:
+                    candidates.append((acc[ii - 1, pk], ii - 1, pk))
+        if kk > 0:
+            candidates.append((acc[ii, kk - 1], ii, kk - 1)) # horizontal
+        _, ii, kk = min(candidates)
+        path.append((ii, cols[ii, kk]))
+    return np.array(path[::-1], dtype=int), cost
+
+
+def warp_indices(x, y, band, open_end=False, slope=None):
+    """Index into y that each element of x is aligned with.
+
+    Where the warping path maps one element of x onto several elements of y,
+    the middle one is used.
+
+    :param x: Numpy array of shape (n,) or (n, d).
+    :param y: Numpy array of shape (m,) or (m, d).
+    :param band: Half width of the band, see :func:`banded_dtw`.
+    :param open_end: See :func:`banded_dtw`.
+    :param slope: See :func:`banded_dtw`.
+    :return: Integer numpy array of length n.
+    """
+    path, _ = banded_dtw(x, y, band, open_end, slope)
+    first = np.searchsorted(path[:, 0], np.arange(len(x)), side='left')
+    last = np.searchsorted(path[:, 0], np.arange(len(x)), side='right') - 1
+    return (path[first, 1] + path[last, 1]) // 2
+
+
+def align_depths(distance, hardness, manual_distance, manual_hardness, band=100, open_end=True):
+    """Map SMP depths onto the depth axis of a manual profile.
+
+    Both profiles must be sampled at the same (SMP) resolution and start at
+    the snow surface. The band is centered on equal depths.
+
+    :param distance: Numpy array of SMP depths in mm.
+    :param hardness: Numpy array of hand hardness indices derived from the SMP
+           force at these depths.
+    :param manual_distance: Numpy array of depths in mm of the manual profile.
+    :param manual_hardness: Numpy array of the manual hand hardness indices at
+           these depths.
+    :param band: Maximal deviation of the two depth axes in mm.
+    :param open_end: When ``True``, the SMP profile may end above the bottom
+           of the manual profile.
+    :return: Numpy array with the depth in the manual profile for each SMP depth.
+    """
+    distance = np.asarray(distance, dtype=float)
+    manual_distance = np.asarray(manual_distance, dtype=float)
+    if len(distance) < 2:
+        return manual_distance[np.zeros(len(distance), dtype=int)]
+    resolution = np.median(np.diff(distance))
+    idx = warp_indices(hardness, manual_hardness, int(np.ceil(band / resolution)), open_end, slope=1)
+    return manual_distance[idx]
@@ -0,0 +1,363 @@
+"""Batch processing of many SnowMicroPen recordings.
+
+The functions in here apply the workflows that are otherwise done profile by
+profile (e. g. in the GUI) to whole folders of pnt files or lists of profiles.
+The work is spread over a pool of worker processes and a summary with one row
+per file is returned.
+
+Auto-detection of surface and ground can also be run from the command line::
+
+    pyndetect /path/to/campaign --workers 8
+"""
+
+import argparse
+import configparser
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import logging
+import os
+import pathlib
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from . import detection, loewe2012
+from .derivatives import parameterizations
+from .pnt import Pnt
+from .profile import Profile, _samples_from_pnt, _write_atomically, _write_ini
+from .serialize import caaml
+
+log = logging.getLogger('snowmicropyn')
+
+_DETECTION_MARKERS = ('surface', 'ground')
+_DETECTION_COLUMNS = ['file', 'status', 'surface', 'ground', 'seconds', 'error']
+_EXPORT_COLUMNS = ['file', 'status', 'outfile', 'seconds', 'error']
+
+_export_classifier = None # grain shape classifier of an export worker process
+
+
+class _DetectionInput:
+    """Just the parts of a profile the detection algorithms need.
+
+    Unlike :class:`snowmicropyn.Profile`, this skips meta data processing and
+    the ini file.
+    """
+
+    def __init__(self, pnt_file):
+        header, raw_samples = Pnt.load(pnt_file)
+        self.name = pnt_file.stem
+        self.samples = _samples_from_pnt(header, raw_samples)
+        self.overload = header[Pnt.Header.SENSOR_OVERLOAD].value
+
+    def __str__(self):
+        return self.name
+
+
+def find_pnt_files(folder):
+    """Find all pnt files in a directory tree.
+
+    :param folder: A `path-like object`_ of the root folder.
+    :return: Sorted list of ``pathlib.Path`` objects.
+
+    .. _path-like object: https://docs.python.org/3/glossary.html#term-path-like-object
+    """
+    files = pathlib.Path(folder).rglob('*')
+    return sorted(ff for ff in files if ff.is_file() and ff.suffix.lower() == '.pnt')
+
+
+def detect_file(pnt_file, force=False):
+    """Detect surface and ground of a single pnt file and save them to its ini file.
+
+    Markers that are already set in the ini file are kept unless ``force`` is
+    set. In case both markers are present, the pnt file is not read at all.
+    The ini file is replaced atomically.
+
+    :param pnt_file: A `path-like object`_ of the pnt file.
+    :param force: When ``True``, existing surface and ground markers are
+           overwritten.
+    :return: Dictionary with the keys 'file', 'status' ('detected', 'skipped'
+             or 'failed'), 'surface', 'ground', 'seconds' and 'error'.
+
+    .. _path-like object: https://docs.python.org/3/glossary.html#term-path-like-object
+    """
+    start = time.perf_counter()
+    pnt_file = pathlib.Path(pnt_file)
+    ini_file = pnt_file.with_suffix('.ini')
+    result = {'file': str(pnt_file), 'status': 'skipped', 'surface': np.nan, 'ground': np.nan, 'error': ''}
+    try:
+        ini = configparser.ConfigParser()
+        ini.read(ini_file) # missing file is no error
+        for section in ('markers', 'quality assurance'):
+            if not ini.has_section(section):
+                ini.add_section(section)
+
+        missing = [mm for mm in _DETECTION_MARKERS if force or not ini.has_option('markers', mm)]
+        if missing:
+            data = _DetectionInput(pnt_file)
+            if 'surface' in missing:
+                ini.set('markers', 'surface', str(float(detection.detect_surface(data))))
+            if 'ground' in missing:
+                ini.set('markers', 'ground', str(float(detection.detect_ground(data))))
+            _write_ini(ini, ini_file)
+            result['status'] = 'detected'
+
+        for mm in _DETECTION_MARKERS:
+            result[mm] = ini.getfloat('markers', mm)
+    except Exception as e: # one broken file must not stop the whole batch
+        log.warning('Detection of surface and ground failed for {}: {}'.format(pnt_file, e))
+        result['status'] = 'failed'
+        result['error'] = str(e)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def detect_markers(folder, force=False, workers=None):
+    """Detect surface and ground of all pnt files in a directory tree.
+
+    The files are processed by a pool of worker processes (see
+    :func:`detect_file` for what happens to each file).
+
+    :param folder: A `path-like object`_ of the root folder.
+    :param force: When ``True``, existing surface and ground markers are
+           overwritten.
+    :param workers: Number of worker processes. ``None`` uses the number of
+           processors, ``1`` processes the files in the current process.
+    :return: Pandas dataframe with one row per file and the columns 'file',
+             'status', 'surface', 'ground', 'seconds' and 'error'.
+
+    .. _path-like object: https://docs.python.org/3/glossary.html#term-path-like-object
+    """
+    files = find_pnt_files(folder)
+    log.info('Detecting surface and ground in {} files of {}'.format(len(files), folder))
+    if workers == 1 or len(files) < 2:
+        results = [detect_file(ff, force) for ff in files]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(detect_file, files, [force] * len(files)))
+    return pd.DataFrame(results, columns=_DETECTION_COLUMNS)
+
+
+def _caaml_outfile(profile, outfile=None):
+    """File name for the CAAML export of a profile (see :func:`export_caaml_profile`)."""
+    # add _smp flag to file name in order to (hopefully) not overwrite hand profiles:
+    stem = f'{profile.pnt_file.stem}_smp'
+    if outfile:
+        outfile = pathlib.Path(outfile) # full file name was given
+        if outfile.is_dir(): # folder name was given -> choose filename
+            outfile = outfile / f'{stem}.caaml'
+    else: # no name was given --> choose full path
+        outfile = profile.pnt_file.with_name(stem).with_suffix('.caaml')
+    return outfile
+
+
+def export_caaml_profile(profile, outfile=None, parameterization='P2015', export_settings=None, classifier=None):
+    """Export a profile to CAAML with derived values, layers and (optionally) grain shapes.
+
+    The CAAML file is replaced atomically.
+
+    :param profile: A :class:`snowmicropyn.Profile`.
+    :param outfile: A `path-like object`_ of the CAAML file or of a folder to
+           write it to. By default it is written next to the pnt file, named
+           like it with the suffix ``_smp.caaml``.
+    :param parameterization: Short name of the parameterization for density
+           and SSA.
+    :param export_settings: Dictionary with export settings, see
+           :func:`snowmicropyn.serialize.caaml.export`. Grain shapes are
+           exported if 'export_grainshape' is set.
+    :param classifier: Grain shape classifier (or compiled predictor) to use.
+           By default one is trained or loaded with
+           :func:`cached_classifier <snowmicropyn.ai.grain_classifier.cached_classifier>`.
+    :return: ``pathlib.Path`` of the CAAML file.
+
+    .. _path-like object: https://docs.python.org/3/glossary.html#term-path-like-object
+    """
+    export_settings = export_settings or {}
+    samples = profile.samples_within_snowpack()
+    param = parameterizations[parameterization]
+    loewe2012_df = loewe2012.calc(samples, param.window_size, param.overlap)
+    derivatives = loewe2012_df.merge(param.calc_from_loewe2012(loewe2012_df))
+    outfile = _caaml_outfile(profile, outfile)
+
+    grain_shapes = []
+    if export_settings.get('export_grainshape', False): # start machine learning process
+        if classifier is None:
+            from .ai.grain_classifier import cached_classifier # importing scikit-learn is slow
+            classifier = cached_classifier(export_settings) # trains only once for many profiles
+        # Predict on the rows that remain after filtering (the classifier applies the same
+        # filters, which then keep all rows), so that there is one grain shape per row:
+        derivatives = caaml.preprocess_lowlevel(derivatives, dict(export_settings, smoothing=False))
+        grain_shapes = classifier.predict(derivatives[loewe2012_df.columns])
+
+    _write_atomically(outfile, lambda stream: caaml.export(export_settings, derivatives, grain_shapes,
+        profile.pnt_file.stem, profile._timestamp, profile._smp_serial, profile._longitude,
+        profile._latitude, profile._altitude, stream), encoding='UTF-8', newline='\n')
+    return outfile
+
+
+def _init_export_worker(classifier):
+    """Keep the classifier in the worker process, it is transferred only once per worker."""
+    global _export_classifier
+    _export_classifier = classifier
+
+
+def _export_one(source, markers, samples, outfolder, parameterization, export_settings, classifier=None):
+    """Export a single profile to CAAML and report what happened.
+
+    :param source: A :class:`snowmicropyn.Profile` or the pnt file name.
+    :param markers: Markers to set on a profile loaded from its pnt file
+           (``None`` to use the ones of the ini file).
+    :param samples: Samples to use instead of the ones of the pnt file
+           (``None`` to use the pnt file's), e. g. after a drift correction.
+    :return: Dictionary with the keys of :data:`_EXPORT_COLUMNS`.
+    """
+    start = time.perf_counter()
+    pnt_file = source.pnt_file if isinstance(source, Profile) else pathlib.Path(source)
+    result = {'file': str(pnt_file), 'status': 'exported', 'outfile': '', 'error': ''}
+    try:
+        profile = source
+        if not isinstance(profile, Profile):
+            profile = Profile.load(pnt_file)
+            if markers is not None: # markers of the caller's profile, maybe not saved to the ini file
+                for label in profile.markers:
+                    profile.remove_marker(label)
+                for label, value in markers.items():
+                    profile.set_marker(label, value)
+            if samples is not None: # the caller's samples, maybe changed in memory
+                profile._samples = samples
+                profile._drift_fit = None
+        if classifier is None:
+            classifier = _export_classifier
+        outfile = export_caaml_profile(profile, outfolder, parameterization, export_settings, classifier)
+        result['outfile'] = str(outfile)
+    except Exception as e: # one broken file must not stop the whole batch
+        log.warning('CAAML export failed for {}: {}'.format(pnt_file, e))
+        result['status'] = 'failed'
+        result['error'] = str(e)
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def _prepare_export_classifier(export_settings, compile_model):
+    """Train or load the grain shape classifier once for a batch export."""
+    if not export_settings.get('export_grainshape', False):
+        return None
+    from .ai.grain_classifier import cached_classifier # importing scikit-learn is slow
+    classifier = cached_classifier(export_settings)
+    if compile_model:
+        try: # plain numpy arrays are fast to transfer and the workers don't need scikit-learn
+            return classifier.compile()
+        except ValueError as e:
+            log.info('Using the scikit-learn classifier in the workers: {}'.format(e))
+    return classifier
+
+
+def export_caaml(profiles, export_settings=None, parameterization='P2015', outfolder=None, workers=None,
+        progress=None):
+    """Export many profiles to CAAML with a pool of worker processes.
+
+    Derived values, layers and grain shapes are calculated in the workers (see
+    :func:`export_caaml_profile` for what happens to each profile). When grain
+    shapes are exported, the classifier is trained or loaded only once and
+    handed to each worker once, compiled to a :class:`NumpyPredictor
+    <snowmicropyn.ai.numpy_predictor.NumpyPredictor>` if the model allows it.
+
+    :param profiles: Iterable of :class:`snowmicropyn.Profile` objects or
+           `path-like objects`_ of pnt files. The markers and samples of
+           profile objects are used even if they differ from the files (e. g.
+           after :meth:`snowmicropyn.Profile.correct_drift`).
+    :param export_settings: Dictionary with export settings, see
+           :func:`snowmicropyn.serialize.caaml.export`.
+    :param parameterization: Short name of the parameterization for density
+           and SSA.
+    :param outfolder: Folder to write the CAAML files to. By default each one
+           is written next to its pnt file.
+    :param workers: Number of worker processes. ``None`` uses the number of
+           processors, ``1`` processes the profiles in the current process.
+    :param progress: Function called with the number of finished profiles and
+           the total number of profiles each time a profile is done. If it
+           returns ``False``, profiles that have not been started yet are
+           skipped.
+    :return: Pandas dataframe with one row per profile (in the given order) and
+             the columns 'file', 'status' ('exported', 'failed' or
+             'cancelled'), 'outfile', 'seconds' and 'error'.
+
+    .. _path-like objects: https://docs.python.org/3/glossary.html#term-path-like-object
+    """
+    export_settings = export_settings or {}
+    profiles = list(profiles)
+    total = len(profiles)
+    pnt_files = [pp.pnt_file if isinstance(pp, Profile) else pathlib.Path(pp) for pp in profiles]
+    results = [{'file': str(ff), 'status': 'cancelled', 'outfile': '', 'seconds': 0., 'error': ''} for ff in pnt_files]
+    log.info('Exporting {} profiles to CAAML'.format(total))
+    serial = workers == 1 or total < 2
+    classifier = _prepare_export_classifier(export_settings, compile_model=not serial)
+
+    if serial:
+        for ii, pp in enumerate(profiles):
+            results[ii] = _export_one(pp, None, None, outfolder, parameterization, export_settings, classifier)
+            if progress and progress(ii + 1, total) is False:
+                break
+    else:
+        # Profile objects can not be sent to other processes. They are reloaded there
+        # with the caller's markers and samples, which may differ from the files.
+        states = [(pp.markers, pp.samples) if isinstance(pp, Profile) else (None, None) for pp in profiles]
+        todo = list(enumerate(zip(pnt_files, states)))[::-1]
+        max_running = 2 * (workers or os.cpu_count() or 1) # submit gradually to be able to stop
+        running = {}
+        cancelled = False
+        done = 0
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_export_worker,
+                initargs=(classifier,)) as pool:
+            while running or (todo and not cancelled):
+                while todo and not cancelled and len(running) < max_running:
+                    ii, (ff, (mm, ss)) = todo.pop()
+                    running[pool.submit(_export_one, ff, mm, ss, outfolder, parameterization,
+                        export_settings)] = ii
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    results[running.pop(future)] = future.result()
+                    done += 1
+                    if progress and progress(done, total) is False:
+                        cancelled = True
+    return pd.DataFrame(results, columns=_EXPORT_COLUMNS)
+
+
+def drift_table(profiles, begin=None, end=None):
+    """Drift, offset and noise of many profiles.
+
+    :param profiles: Iterable of :class:`snowmicropyn.Profile` objects.
+    :param begin: Start of the range for the fit (see
+           :meth:`snowmicropyn.Profile.drift`). ``None`` uses each profile's
+           default range.
+    :param end: End of the range for the fit.
+    :return: Pandas dataframe with the columns 'name', 'drift', 'offset' and
+             'noise', one row per profile.
+    """
+    rows = [(pp.name,) + pp.drift(begin, end) for pp in profiles]
+    return pd.DataFrame(rows, columns=['name', 'drift', 'offset', 'noise'])
+
+
+def main(argv=None):
+    """Command line entry point for batch detection of surface and ground."""
+    parser = argparse.ArgumentParser(prog='pyndetect',
+        description='Detect surface and ground of all pnt files in a folder and save them to ini files.')
+    parser.add_argument('folder', help='root folder to search for pnt files')
+    parser.add_argument('-f', '--force', action='store_true',
+        help='overwrite surface and ground markers that are already set')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+        help='number of worker processes (default: number of processors)')
+    parser.add_argument('-o', '--output', default=None, help='also write the summary to this CSV file')
+    args = parser.parse_args(argv)
+
+    summary = detect_markers(args.folder, force=args.force, workers=args.workers)
+    print(summary.to_string(index=False, float_format='{:.3f}'.format))
+    counts = summary.status.value_counts()
+    print(', '.join('{} {}'.format(counts.get(ss, 0), ss) for ss in ('detected', 'skipped', 'failed')))
+    if args.output:
+        summary.to_csv(args.output, index=False)
+    return 1 if counts.get('failed', 0) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -13,6 +13,7 @@ with this.
 import snowmicropyn.windowing
 import pandas as pd
 import numpy as np
+import warnings
 
 class Parameterizations:
     def __init__(self):
@@ -109,4 +110,38 @@ class Derivatives:
         return pd.DataFrame(result, columns=['distance', self.shortname + '_density',
             self.shortname + '_ssa'])
 
+    def calc_bootstrap(self, samples, resamples=200, block_length=None, percentiles=(2.5, 97.5),
+        seed=None):
+        """Calculate ssa and density together with bootstrapped confidence bands.
+
+        The point estimates are the same as the ones returned by :meth:`calc`. For the
+        bands, the force signal of every window is resampled with a moving block bootstrap
+        (cf. :func:`snowmicropyn.loewe2012.bootstrap`) and the resamples are fed through
+        this parameterization as whole arrays.
+
+        :param samples: A pandas dataframe containing the columns 'distance' and 'force'.
+        :param resamples: Number of bootstrap resamples per window.
+        :param block_length: Number of consecutive samples per bootstrap block (default:
+               cube root of the window's sample count).
+        :param percentiles: Lower and upper percentile of the band.
+        :param seed: Seed for the random number generator.
+        :return: A pandas dataframe with the columns distance, density and ssa plus
+                 density_lower, density_upper, ssa_lower and ssa_upper.
+        """
+        result = self.calc(samples)
+        _, sn = snowmicropyn.loewe2012.bootstrap(samples, self.window_size, self.overlap,
+            resamples, block_length, seed)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            density, ssa = self.calc_step(sn['force_median'], sn['L2012_L'], sn['L2012_lambda'],
+                sn['L2012_f0'], sn['L2012_delta'])
+        ssa = np.broadcast_to(ssa, np.shape(density))
+
+        for name, values in (('_density', density), ('_ssa', ssa)):
+            with warnings.catch_warnings(): # windows without valid resamples stay nan
+                warnings.simplefilter('ignore', category=RuntimeWarning)
+                lower, upper = np.nanpercentile(values, percentiles, axis=1)
+            result[self.shortname + name + '_lower'] = lower
+            result[self.shortname + name + '_upper'] = upper
+        return result
+
 parameterizations = Parameterizations() # access throughout SMPyn via this
@@ -7,6 +7,32 @@ from .tools import downsample, smooth
 log = logging.getLogger('snowmicropyn')
 
 
+def _ground_distance(distance, force, overload):
+    """Ground detection on plain numpy arrays.
+
+    :param distance: Numpy array of the sample distances (sorted).
+    :param force: Numpy array of the force values.
+    :param overload: Overload value of the SMP in N.
+    :return: Distance where ground was detected.
+    """
+    if force.size == 0 or force.max() < overload:
+        return distance[-1]
+
+    i_ol = force.argmax()
+    i_threshhold = np.searchsorted(distance, distance[i_ol] - 20, side='left')
+    f_mean = np.mean(force[0:i_threshhold])
+    f_std = np.std(force[0:i_threshhold])
+    threshhold = f_mean + 5 * f_std
+
+    # Walk back from the overload in steps of 10 samples until the force
+    # drops to the threshold (nan threshold: stay at the overload)
+    segment = force[i_ol::-10]
+    below = np.flatnonzero(~(segment > threshhold))
+    if below.size == 0: # force never drops below threshold
+        return distance[0]
+    return distance[i_ol - 10 * below[0]]
+
+
 def detect_ground(profile):
     """Automatic detection of ground (end of snowpack).
 
@@ -14,61 +40,99 @@ def detect_ground(profile):
     :return: Distance where ground was detected.
     :rtype: float
     """
+    ground = _ground_distance(profile.samples.distance.values, profile.samples.force.values,
+        profile.overload)
+    log.info('Detected ground at {:.3f} mm in profile {}'.format(ground, profile))
+    return ground
 
-    force = profile.samples.force
-    distance = profile.samples.distance
 
-    ground = distance.iloc[-1]
+def detect_grounds(profiles):
+    """Automatic detection of ground for many profiles at once.
 
-    if force.max() >= profile.overload:
-        i_ol = force.argmax()
-        i_threshhold = np.where(distance.values >= distance.values[i_ol] - 20)[0][0]
-        f_mean = np.mean(force.iloc[0:i_threshhold])
-        f_std = np.std(force.iloc[0:i_threshhold])
-        threshhold = f_mean + 5 * f_std
+    :param profiles: Iterable of :class:`snowmicropyn.Profile` objects.
+    :return: List of distances where ground was detected, in the order of
+             the profiles.
+    :rtype: list
+    """
+    return [detect_ground(profile) for profile in profiles]
 
-        while force.iloc[i_ol] > threshhold:
-            i_ol -= 10
 
-        ground = distance.iloc[i_ol]
+def _surface_gradient(profile):
+    """Downsampled and smoothed force gradient used for surface detection.
 
-    log.info('Detected ground at {:.3f} mm in profile {}'.format(ground, profile))
-    return ground
+    :param profile: The profile to detect surface in.
+    :return: Tuple of distance, force gradient and maximum of the smoothed force.
+    """
+    # Cut off ca. 1 mm
+    distance = profile.samples.distance.values[250:]
+    force = profile.samples.force.values[250:]
 
+    force = downsample(force, 20)
+    distance = downsample(distance, 20)
 
-def detect_surface(profile):
-    """Automatic detection of surface (begin of snowpack).
+    force = smooth(force, 242)
 
-    :param profile: The profile to detect surface in.
-    :return: Distance where surface was detected.
-    :rtype: float
+    y_grad = np.gradient(force)
+    y_grad = downsample(y_grad, 3)
+    x_grad = downsample(distance, 3)
+
+    max_force = np.amax(force)
+    return x_grad, y_grad, max_force
+
+
+def _first_outlier(y_grad, begin=100, factor=5):
+    """Find the first value exceeding the statistics of all values before it.
+
+    For each index ``i >= begin`` the mean and standard deviation of the values
+    up to ``i - 1`` (exclusive) are taken from running sums, which makes this
+    linear in the signal length.
+
+    :param y_grad: 2D numpy array, one signal per row. Rows of different
+           length can be padded with nan at the end.
+    :param begin: First index to check.
+    :param factor: Number of standard deviations a value must exceed the mean.
+    :return: Numpy array with the index of the first outlier per row, or -1
+             where none was found.
     """
+    y_grad = np.atleast_2d(y_grad)
+    idx = np.arange(begin, y_grad.shape[1])
+    if idx.size == 0:
+        return np.full(y_grad.shape[0], -1)
 
-    # Cut off ca. 1 mm
-    try:
-        distance = profile.samples.distance.values[250:]
-        force = profile.samples.force.values[250:]
+    # Shift by the first value to keep the running sums well conditioned
+    shifted = y_grad - y_grad[:, :1]
+    csum = np.cumsum(shifted, axis=1)
+    csq = np.cumsum(shifted ** 2, axis=1)
 
-        force = downsample(force, 20)
-        distance = downsample(distance, 20)
+    count = idx - 1 # number of values considered for index i
+    mean = csum[:, count - 1] / count
+    var = csq[:, count - 1] / count - mean ** 2
+    std = np.sqrt(np.maximum(var, 0))
 
-        force = smooth(force, 242)
+    with np.errstate(invalid='ignore'): # padding (nan) never counts as outlier
+        hit = shifted[:, idx] >= factor * std + mean
+    first = np.argmax(hit, axis=1)
+    return np.where(hit.any(axis=1), idx[first], -1)
 
-        y_grad = np.gradient(force)
-        y_grad = downsample(y_grad, 3)
-        x_grad = downsample(distance, 3)
 
-        max_force = np.amax(force)
+def _surface_from_index(x_grad, i, max_force):
+    # No outlier found (or only at the very end): fall back to maximum force
+    if i < 0 or i == x_grad.size - 1:
+        return max_force
+    return x_grad[i]
 
-        for i in np.arange(100, x_grad.size):
-            std = np.std(y_grad[:i - 1])
-            mean = np.mean(y_grad[:i - 1])
-            if y_grad[i] >= 5 * std + mean:
-                surface = x_grad[i]
-                break
 
-        if i == x_grad.size - 1:
-            surface = max_force
+def detect_surface(profile):
+    """Automatic detection of surface (begin of snowpack).
+
+    :param profile: The profile to detect surface in.
+    :return: Distance where surface was detected.
+    :rtype: float
+    """
+    try:
+        x_grad, y_grad, max_force = _surface_gradient(profile)
+        i = _first_outlier(y_grad)[0]
+        surface = _surface_from_index(x_grad, i, max_force)
 
         log.info('Detected surface at {:.3f} mm in profile {}'.format(surface, profile))
         return surface
@@ -76,3 +140,41 @@ def detect_surface(profile):
     except ValueError:
         log.warning('Failed to detect surface')
         return 0
+
+
+def detect_surfaces(profiles):
+    """Automatic detection of surface for many profiles at once.
+
+    The gradients of all profiles are stacked into a single array and the
+    search for the surface is done for all of them together.
+
+    :param profiles: Iterable of :class:`snowmicropyn.Profile` objects.
+    :return: List of distances where surface was detected (0 where detection
+             failed), in the order of the profiles.
+    :rtype: list
+    """
+    profiles = list(profiles)
+    gradients = []
+    for profile in profiles:
+        try:
+            gradients.append(_surface_gradient(profile))
+        except ValueError:
+            log.warning('Failed to detect surface in profile {}'.format(profile))
+            gradients.append(None)
+
+    valid = [grad for grad in gradients if grad is not None]
+    stacked = np.full((len(valid), max([grad[1].size for grad in valid], default=0)), np.nan)
+    for row, (_, y_grad, _) in enumerate(valid):
+        stacked[row, :y_grad.size] = y_grad
+    first = iter(_first_outlier(stacked))
+
+    surfaces = []
+    for profile, grad in zip(profiles, gradients):
+        if grad is None:
+            surfaces.append(0)
+            continue
+        x_grad, _, max_force = grad
+        surface = _surface_from_index(x_grad, next(first), max_force)
+        log.info('Detected surface at {:.3f} mm in profile {}'.format(surface, profile))
+        surfaces.append(surface)
+    return surfaces
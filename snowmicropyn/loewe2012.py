@@ -21,7 +21,7 @@ import numpy as np
 from scipy import signal
 import logging
 
-from .windowing import chunkup
+from .windowing import chunkup, chunk_bounds
 
 log = logging.getLogger('snowmicropyn')
 
@@ -29,6 +29,8 @@ log = logging.getLogger('snowmicropyn')
 SMP_CONE_DIAMETER = 5  # [mm]
 #: Default value for SnowMicroPen's projected cone area, depends on :const:`SMP_CONE_DIAMETER`.
 SMP_CONE_AREA = (SMP_CONE_DIAMETER / 2.) ** 2 * math.pi  # [mm^2]
+#: Upper limit for the number of force values held in memory at once while bootstrapping.
+BOOTSTRAP_BATCH_SIZE = 2 ** 22
 
 def calc_step(spatial_res, forces, cone_area=SMP_CONE_AREA):
     """Calculate shot noise parameters for a segment of a profile.
@@ -105,3 +107,125 @@ def calc(samples, window, overlap):
         if len(log.handlers) > 1: # we are in the GUI
             log.handlers[1].toTop()
     return result
+
+
+def calc_step_batch(spatial_res, forces, cone_area=SMP_CONE_AREA):
+    """Calculate shot noise parameters for many segments of equal length at once.
+
+    This is a vectorized version of :func:`calc_step`. The linear detrending
+    and the two needed values of the autocorrelation (lag 0 and lag 1) are
+    evaluated in closed form along the last axis, so any number of segments
+    can be processed in one go.
+
+    :param spatial_res: Spatial resolution of profile.
+    :param forces: Numpy array of shape (..., n) containing the force values,
+           one segment per row.
+    :param cone_area: Projected area of cone (tip) of SnowMicroPen in square
+           millimeters.
+    :return: A tuple of numpy arrays of shape (...) containing lambda, f0,
+             delta and L.
+    """
+    forces = np.asarray(forces, dtype=float)
+    n = forces.shape[-1]
+
+    k1 = forces.mean(axis=-1)
+    centered = forces - k1[..., np.newaxis]
+    k2 = (centered ** 2).mean(axis=-1)
+
+    # Linear detrending: subtract least squares line through the segment
+    tt = np.arange(n) - (n - 1) / 2.
+    slope = (centered @ tt) / (tt @ tt)
+    force_detrended = centered - slope[..., np.newaxis] * tt
+
+    # Autocorrelation at lag 0 and lag 1 (c_f[n - 1] and c_f[n] in calc_step)
+    c_0 = (force_detrended ** 2).sum(axis=-1)
+    c_1 = (force_detrended[..., :-1] * force_detrended[..., 1:]).sum(axis=-1)
+
+    return _shot_noise(spatial_res, k1, k2, c_0, c_1, cone_area)
+
+
+def _shot_noise(spatial_res, k1, k2, c_0, c_1, cone_area):
+    """Equations 11, 12 and 2 of the publication on whole arrays."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta = -(3. / 2) * c_0 / (c_1 - c_0) * spatial_res
+        lambda_ = (4. / 3) * (k1 ** 2) / k2 / delta
+        f0 = (3. / 2) * k2 / k1
+        L = (cone_area / lambda_) ** (1. / 3)
+
+    return lambda_, f0, delta, L
+
+
+def bootstrap(samples, window, overlap, resamples=200, block_length=None, seed=None):
+    """Moving block bootstrap of the shot noise model parameters.
+
+    For each window the force signal is resampled by concatenating randomly
+    chosen blocks of consecutive samples. Blocks (instead of single samples)
+    are drawn to keep the correlation between neighbouring samples intact,
+    which the shot noise model relies on. The resamples are detrended with
+    the linear trend of the original window (each sample keeps its original
+    position), and the lag 1 autocorrelation is taken from neighbours within
+    the same block only, so that the joins between blocks do not bias the
+    estimates. All resamples of all windows with the same number of samples
+    are evaluated in batches.
+
+    :param samples: A pandas dataframe with columns called 'distance' and 'force'.
+    :param window: Size of moving window.
+    :param overlap: Overlap factor in percent.
+    :param resamples: Number of bootstrap resamples per window.
+    :param block_length: Number of consecutive samples per block. By default
+           the cube root of the window's sample count is used.
+    :param seed: Seed for the random number generator (for reproducible results).
+    :return: Tuple of the window centers (numpy array of length m) and a
+             dictionary with the keys 'force_median', 'L2012_lambda',
+             'L2012_f0', 'L2012_delta' and 'L2012_L', each holding a numpy
+             array of shape (m, resamples).
+    """
+    rng = np.random.default_rng(seed)
+    spatial_res = np.median(np.diff(samples.distance.values))
+    force = samples.force.values.astype(float)
+    centers, starts, stops = chunk_bounds(samples, window, overlap)
+    sizes = stops - starts
+
+    keys = ('force_median', 'L2012_lambda', 'L2012_f0', 'L2012_delta', 'L2012_L')
+    result = {key: np.full((len(centers), resamples), np.nan) for key in keys}
+
+    # Windows at the profile's ends are shorter, so we batch by window size
+    for n in np.unique(sizes):
+        if n < 3: # not enough samples for an autocorrelation
+            continue
+        block = block_length if block_length else max(2, int(round(n ** (1. / 3))))
+        block = min(max(block, 2), n) # at least one pair of neighbours per block
+        n_blocks = -(-n // block) # ceiling division
+        block_offsets = np.arange(block)
+        # Pairs of neighbours that do not straddle the join of two blocks
+        within = np.arange(n - 1) % block != block - 1
+        tt = np.arange(n) - (n - 1) / 2.
+
+        windows = np.flatnonzero(sizes == n)
+        batch = max(1, BOOTSTRAP_BATCH_SIZE // (resamples * n_blocks * block))
+        for first in range(0, len(windows), batch):
+            ww = windows[first:first + batch]
+            original = force[starts[ww][:, np.newaxis] + np.arange(n)]
+            centered = original - original.mean(axis=1)[:, np.newaxis]
+            slope = (centered @ tt) / (tt @ tt)
+            residuals = centered - slope[:, np.newaxis] * tt
+
+            # Draw block starts for all resamples of all windows at once
+            block_starts = rng.integers(0, n - block + 1, size=(len(ww), resamples, n_blocks))
+            idx = (block_starts[..., np.newaxis] + block_offsets).reshape(len(ww), resamples, -1)[..., :n]
+            rows = np.arange(len(ww))[:, np.newaxis, np.newaxis]
+            resampled = original[rows, idx]
+            detrended = residuals[rows, idx]
+            detrended -= detrended.mean(axis=-1)[..., np.newaxis]
+
+            k1 = resampled.mean(axis=-1)
+            k2 = resampled.var(axis=-1)
+            c_0 = (detrended ** 2).sum(axis=-1)
+            products = detrended[..., :-1] * detrended[..., 1:]
+            c_1 = products[..., within].sum(axis=-1) * (n - 1) / within.sum()
+
+            result['force_median'][ww] = np.median(resampled, axis=-1)
+            sn = _shot_noise(spatial_res, k1, k2, c_0, c_1, SMP_CONE_AREA)
+            for key, values in zip(keys[1:], sn):
+                result[key][ww] = values
+    return centers, result
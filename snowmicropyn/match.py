@@ -1,68 +1,162 @@
 """This module performs layer matching between profiles."""
+from snowmicropyn import alignment
 from snowmicropyn.serialize import caaml
+import logging
+import numpy as np
+import pandas as pd
 import re
 
+log = logging.getLogger('snowmicropyn')
+
+def _layer_indices(shapes, distance):
+    """Interval join of depths with manual layers, see :func:`match_layers_exact`.
+
+    param shapes: Pandas dataframe with the columns 'depthTop' and 'thickness'.
+    param distance: Numpy array of depths.
+    returns: Layers sorted by top and the index into them for each depth.
+    """
+    if len(shapes) == 0:
+        raise ValueError('No layers to match the SMP profile with.')
+    shapes = shapes.sort_values('depthTop', kind='stable')
+    tops = shapes.depthTop.to_numpy(dtype=float)
+    bottoms = tops + shapes.thickness.to_numpy(dtype=float)
+    if np.any(tops[1:] < bottoms[:-1]):
+        log.warning('Manual layers overlap, deeper layers take precedence')
+    # Deepest point covered by any of the layers so far
+    covered = np.maximum.accumulate(bottoms)
+
+    idx = np.searchsorted(tops, distance, side='left') - 1 # last layer starting above
+    idx = np.maximum(idx, 0)
+    gap = distance > covered[idx]
+    idx = np.minimum(idx + gap, len(tops) - 1)
+    return shapes, idx
+
 def match_layers_exact(samples, shapes):
     """Align a SMP profile with a manual one by comparing penetration depth
     with measured top of layer.
 
+    Each row gets the grain shape of the layer it lies in. Rows above the
+    first layer get the first layer's shape, rows below the last layer the
+    last layer's shape and rows in a gap between two layers the shape of the
+    layer below the gap. Layers do not need to be sorted. Where layers
+    overlap, the layer with the deeper top takes over from its top on.
+
     param samples: Pandas dataframe with measured SMP forces.
-    param shapes: List of grain shapes (one entry per SMP data row).
+    param shapes: Pandas dataframe with the columns 'depthTop', 'thickness' and
+    'grainFormPrimary' (one row per manual layer).
     returns: Pandas dataframe with a new column containing the grain shapes.
     """
-    shape_list = []
+    shapes, idx = _layer_indices(shapes, samples.distance.to_numpy(dtype=float))
     data = samples
-    idx = 0
-    for ii in range(len(samples.distance)):
-        if samples.distance[ii] > shapes.depthTop[idx] + shapes.thickness[idx]:
-            if idx < len(shapes.depthTop) - 1:
-                idx = idx + 1
-        shape_list.append(shapes.grainFormPrimary[idx])
-
-    data['grain_shape'] = shape_list
+    data['grain_shape'] = shapes.grainFormPrimary.to_numpy()[idx]
     return data
 
+def match_layers_dtw(samples, shapes, surface=0, ground=None, band=100):
+    """Align a SMP profile with a manual one by dynamic time warping of the
+    hand hardness profiles (see :mod:`snowmicropyn.alignment`).
+
+    Unlike :func:`match_layers_exact` this copes with settling and layers
+    of varying thickness between the SMP measurement and the snow pit, as
+    long as the depths deviate less than the band width.
+
+    param samples: Pandas dataframe with derived SMP quantities (including the
+    median force).
+    param shapes: Pandas dataframe with the columns 'depthTop', 'thickness' (both
+    in mm, measured from the surface), 'grainFormPrimary' and 'hardness'.
+    param surface: Distance of the snow surface in the SMP data.
+    param ground: Distance of the ground in the SMP data. Rows below are removed.
+    param band: Maximal deviation of the two depth axes in mm.
+    returns: Pandas dataframe with a new column containing the grain shapes.
+    Rows above the surface are removed.
+    """
+    layer_hardness = pd.Series([caaml._hardness_identifier_to_index(hh) for hh in shapes.hardness])
+    if layer_hardness.isna().all():
+        raise ValueError('Matching by dynamic time warping needs the hand hardness of the manual layers.')
+    shapes = shapes.assign(hardness=layer_hardness.ffill().bfill().to_numpy())
+
+    valid = samples.distance >= surface
+    if ground is not None:
+        valid &= samples.distance <= ground
+    data = samples[valid].copy()
+    depth = data.distance.to_numpy(dtype=float) - surface
+    if len(depth) == 0:
+        data['grain_shape'] = pd.Series(dtype=object)
+        return data
+
+    # Manual profile as step function at the resolution of the SMP data
+    resolution = np.median(np.diff(depth)) if len(depth) > 1 else 1.
+    manual_bottom = (shapes.depthTop + shapes.thickness).max()
+    manual_depth = np.arange(0, max(manual_bottom, resolution), resolution)
+    sorted_shapes, idx = _layer_indices(shapes, manual_depth)
+    manual_hardness = sorted_shapes.hardness.to_numpy()[idx]
+
+    smp_hardness = caaml.hand_hardness(data.force_median.to_numpy(dtype=float))
+    warped = alignment.align_depths(depth, smp_hardness, manual_depth, manual_hardness, band)
+    _, idx = _layer_indices(sorted_shapes, warped)
+    data['grain_shape'] = sorted_shapes.grainFormPrimary.to_numpy()[idx]
+    return data
+
+_layer_marker_regex = re.compile(r'(.*?)(\d+)$')
+
 def match_layers_markers(samples, pro):
     """Extract the grain shapes from manually set markers on the profile.
 
+    Any marker that ends with a number is considered to be the top of a layer
+    (e. g. "rg1"). The layer reaches down to the next marker of any kind, the
+    last one to the end of the data.
+
     param samples: Pandas dataframe with measured SMP forces.
     param pro: snowmicropyn Profile to parse
-    returns: Pandas dataframe with a new column containing the grain shapes.
+    returns: Pandas dataframe with a new categorical column containing the grain shapes.
+    Rows outside of all layers are removed.
     """
-    data = samples
-    data['grain_shape'] = 'NOt_labelled' # n/a value of dataset
-    # sort by sample distance and convert to sorted container for index access:
-    markers = list(sorted(pro.markers.items()))
-    for ii in range(len(markers)):
-        label = markers[ii][0]
-        nr = re.search(r'(.*)(\d+)$', label)
-        if nr is not None: # we consider any marker that ends with a number to be a layer (e. g. "rg1")
+    labels = list(pro.markers.keys())
+    positions = np.array(list(pro.markers.values()), dtype=float)
+    shapes = []
+    for label in labels:
+        nr = _layer_marker_regex.match(label)
+        if nr is None:
+            shapes.append(None)
+        else:
             grain_type = nr.group(1) # marker name without number
             # Markers are read through the config parser as lower case, so in accordance to
             # the ICSSG we must capitalize the main form (first 2 letters):
-            grain_type = grain_type[0:2].upper() + grain_type[2:]
-            pos = markers[ii][1]
-            if (ii == len(markers) - 1):
-                nextpos = float(data.tail(1).distance)
-            else:
-                nextpos = markers[ii + 1][1]
-            data.loc[(data.distance >= pos) & (data.distance < nextpos), 'grain_shape'] = grain_type
-
-    data = data[data.grain_shape != 'NOt_labelled'] # remove unclassified rows
+            shapes.append(grain_type[0:2].upper() + grain_type[2:])
+    order = np.argsort(positions, kind='stable')
+    positions = positions[order]
+    shapes = pd.Categorical([shapes[ii] for ii in order]) # non-layer markers are n/a
+
+    distance = samples.distance.to_numpy(dtype=float)
+    idx = np.searchsorted(positions, distance, side='right') - 1 # last marker above each row
+    # The last layer ends where the data ends (the last row is not included)
+    end = distance[-1] if len(distance) else np.inf
+    valid = (idx >= 0) & ((idx < len(positions) - 1) | (distance < end))
+    codes = np.full(len(distance), -1)
+    codes[valid] = shapes.codes[idx[valid]]
+
+    data = samples
+    data['grain_shape'] = pd.Categorical.from_codes(codes, shapes.categories)
+    data = data[codes >= 0] # remove unclassified rows
     return data
 
 def assimilate_grainshape(samples, pro, method: str):
     """Add grain shape taken from an external (manual) snow profile to the SMP dataset.
 
     param samples: Recorded SMP samples as pandas dataframe.
-    param caaml_file: Path to corresponding (manual) CAAML snow profile containing
-    grain shapes.
+    param pro: snowmicropyn Profile the samples belong to. For methods 'exact' and 'dtw'
+    a CAAML file with the same base name must exist.
+    param method: Layer matching method ('exact', 'dtw' or 'markers').
     returns: SMP samples with assimlated grain shapes.
     """
     if method == 'exact':
         caaml_file = str(pro._pnt_file.resolve())[:-3] + 'caaml'
         grain_shapes = caaml.parse_grainshape(caaml_file)
         data = match_layers_exact(samples, grain_shapes)
+    elif method == 'dtw':
+        caaml_file = str(pro._pnt_file.resolve())[:-3] + 'caaml'
+        grain_shapes = caaml.parse_grainshape(caaml_file, unit='mm')
+        data = match_layers_dtw(samples, grain_shapes, surface=pro.marker('surface', fallback=0),
+            ground=pro.marker('ground', fallback=None))
     elif method == 'markers':
         data = match_layers_markers(samples, pro)
     else:
@@ -4,14 +4,17 @@ from datetime import datetime
 import logging
 from math import cos, pi
 import numpy as np
+import os
 import pathlib
 import pandas as pd
 import pytz
+import tempfile
 
 from . import windowing
 from . import __version__, githash
 from . import detection
 from . import loewe2012
+from .tools import RunningLinFit
 # to keep code for a new parameterization to a single file we import all modules available:
 from .parameterizations import *
 from .derivatives import parameterizations
@@ -20,6 +23,41 @@ from .pnt import Pnt
 
 log = logging.getLogger('snowmicropyn')
 
+def _samples_from_pnt(pnt_header, pnt_samples):
+    """ Build the samples dataframe (distance and force) from the content of a
+    pnt file as returned by :meth:`Pnt.load`. """
+    count = pnt_header[Pnt.Header.SAMPLES_COUNT_FORCE].value
+    distance_arr = np.arange(0, count) * pnt_header[Pnt.Header.SAMPLES_SPATIALRES].value
+    factor = pnt_header[Pnt.Header.SAMPLES_CONVFACTOR_FORCE].value
+    force_arr = np.asarray(pnt_samples) * factor
+    stacked = np.column_stack([distance_arr, force_arr])
+    return pd.DataFrame(stacked, columns=('distance', 'force'))
+
+def _write_atomically(file, write, encoding=None, newline=None, mode='w'):
+    """ Write a file atomically.
+
+    ``write`` is called with a stream (text, or binary for ``mode='wb'``) to
+    a temporary file in the same folder, which then replaces the target, so
+    readers never see a half written file.
+    """
+    file = pathlib.Path(file)
+    fd, tmp = tempfile.mkstemp(prefix='.' + file.name, suffix='.tmp', dir=file.parent)
+    try:
+        with os.fdopen(fd, mode, encoding=encoding, newline=newline) as f:
+            write(f)
+        # mkstemp creates private files, use the permissions a plain open() would
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp, 0o666 & ~umask)
+        os.replace(tmp, file)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def _write_ini(ini, ini_file):
+    """ Write a ``ConfigParser`` to a file atomically. """
+    _write_atomically(ini_file, ini.write)
+
 class Profile(object):
     """ Represents a loaded pnt file.
 
@@ -138,11 +176,9 @@ class Profile(object):
         self._sensor_sensivity = self.pnt_header_value(Pnt.Header.SENSOR_SENSITIVITIY)
 
         # Create a pandas dataframe with distance and force
-        distance_arr = np.arange(0, self._samples_count) * self._spatial_resolution
-        factor = self.pnt_header_value(Pnt.Header.SAMPLES_CONVFACTOR_FORCE)
-        force_arr = np.asarray(pnt_samples) * factor
-        stacked = np.column_stack([distance_arr, force_arr])
-        self._samples = pd.DataFrame(stacked, columns=('distance', 'force'))
+        self._samples = _samples_from_pnt(self._pnt_header, pnt_samples)
+
+        self._drift_fit = None # running sums for drift calculation, built on demand
 
         self._ini = configparser.ConfigParser()
 
@@ -391,6 +427,75 @@ class Profile(object):
         """ Convenience property to access value of 'ground' marker. """
         return self.marker('ground')
 
+    def drift_range(self):
+        """ Returns the default range (begin, end) for the calculation of drift,
+        offset and noise.
+
+        Begin is the marker "drift_begin" or, if it's not set, the 10th sample.
+        End is the marker "drift_end", the marker "surface" or the end of the
+        profile (in this order).
+        """
+        begin = self.marker('drift_begin', fallback=None)
+        if begin is None:
+            # Skip the first few values of profile for drift calculation
+            begin = self.samples.distance.iloc[10]
+        end = self.marker('drift_end', fallback=None)
+        if end is None:
+            end = self.marker('surface', fallback=self.samples.distance.iloc[-1])
+        return begin, end
+
+    def drift(self, begin=None, end=None):
+        """ Calculate drift, offset and noise of the force signal.
+
+        A line is fitted to the force within the range ``[begin, end]`` by
+        least squares. Drift is its slope (in N/mm), offset its value at
+        distance zero (in N) and noise the standard deviation of the residuals
+        (in N). The fit is evaluated from running sums which are calculated
+        once per profile, so repeated calls (e. g. when moving the drift
+        markers) are cheap. ``begin`` and ``end`` can also be arrays to
+        evaluate many ranges in one call.
+
+        :param begin: Start of the range (distance in mm). Default is given by
+               :meth:`drift_range`.
+        :param end: End of the range (distance in mm). Default is given by
+               :meth:`drift_range`.
+        :return: Tuple (drift, offset, noise) of floats, or of numpy arrays
+                 when arrays are passed.
+        """
+        default_begin, default_end = self.drift_range()
+        begin = default_begin if begin is None else begin
+        end = default_end if end is None else end
+        # Flip begin and end to make sure begin is always smaller then end
+        begin, end = np.minimum(begin, end), np.maximum(begin, end)
+
+        if self._drift_fit is None:
+            self._drift_fit = RunningLinFit(self.samples.distance.values, self.samples.force.values)
+        distance = self.samples.distance.values
+        first = np.searchsorted(distance, begin, side='left')
+        last = np.searchsorted(distance, end, side='right')
+        drift, offset, noise = self._drift_fit.fit(first, last)
+        if np.ndim(drift) == 0:
+            return float(drift), float(offset), float(noise)
+        return drift, offset, noise
+
+    def correct_drift(self, begin=None, end=None):
+        """ Subtract the fitted drift and offset from the force signal.
+
+        The line calculated by :meth:`drift` is subtracted from the force
+        column of the samples. Only the force column is replaced, the samples
+        dataframe itself is not copied.
+
+        :param begin: Start of the range for the fit, see :meth:`drift`.
+        :param end: End of the range for the fit, see :meth:`drift`.
+        :return: Tuple (drift, offset, noise) which was used for the correction.
+        """
+        drift, offset, noise = self.drift(begin, end)
+        distance = self._samples['distance'].to_numpy()
+        self._samples['force'] = self._samples['force'].to_numpy() - (drift * distance + offset)
+        self._drift_fit = None # force changed, running sums are outdated
+        log.info('Corrected drift of {:.3g} N/mm and offset of {:.3g} N in {}'.format(drift, offset, self))
+        return drift, offset, noise
+
     def max_force(self):
         """ Get maximum force value of this profile. """
         return self.samples.force.max()
@@ -417,9 +522,8 @@ class Profile(object):
         .. warning::
            An already existing ini file is overwritten with no warning.
         """
-        with self._ini_file.open('w') as f:
-            log.info('Saving ini info of {} to file {}'.format(self, self._ini_file))
-            self._ini.write(f)
+        log.info('Saving ini info of {} to file {}'.format(self, self._ini_file))
+        _write_ini(self._ini, self._ini_file)
 
     def export_samples(self, file=None, precision=4, snowpack_only=False):
         """ Export the samples of this profile into a CSV file.
@@ -1,6 +1,7 @@
 """GUI entry point."""
 
 import logging
+import multiprocessing
 import sys
 import pathlib
 
@@ -14,6 +15,8 @@ from snowmicropyn.pyngui.main_window import MainWindow
 
 
 def main():
+    # Batch exports run in worker processes, which must not start the GUI in a frozen build
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     app.setAttribute(Qt.AA_UseHighDpiPixmaps)
 
@@ -147,6 +147,7 @@ class ExportDialog(QDialog):
         self._inputs['training_data_folder'] = FilePicker('Training data folder:', directory=True)
         self._inputs['training_data_method'] = QComboBox()
         self._inputs['training_data_method'].addItem('exact', 'exact')
+        self._inputs['training_data_method'].addItem('dtw', 'dtw')
         self._inputs['training_data_method'].addItem('markers', 'markers')
         self._inputs['training_data_method'].setToolTip('Method of parsing for training dataset')
         self._inputs['save_model'] = QCheckBox('Save trained model state')
@@ -162,6 +163,14 @@ class ExportDialog(QDialog):
         self._inputs['similarity_percent'] = QLineEdit()
         self._inputs['similarity_percent'].setFixedWidth(_widget_width)
         self._inputs['similarity_percent'].setValidator(QDoubleValidator())
+        self._inputs['layer_method'] = QComboBox()
+        self._inputs['layer_method'].addItem('Similarity of neighbours', 'similarity')
+        self._inputs['layer_method'].addItem('Change point detection', 'changepoint')
+        self._inputs['layer_method'].setToolTip('How layer boundaries are found when merging layers')
+        self._inputs['changepoint_penalty'] = QLineEdit()
+        self._inputs['changepoint_penalty'].setFixedWidth(_widget_width)
+        self._inputs['changepoint_penalty'].setValidator(QDoubleValidator())
+        self._inputs['changepoint_penalty'].setToolTip('Penalty per layer (higher: fewer layers, empty: automatic)')
         self._inputs['discard_thin_layers'] = QCheckBox('Discard layers thinner than:')
         self._inputs['discard_layer_thickness'] = QLineEdit()
         self._inputs['discard_layer_thickness'].setFixedWidth(_widget_width)
@@ -273,6 +282,13 @@ class ExportDialog(QDialog):
         item_layout.addWidget(QLabel('%'))
         pre_smp_layout.addLayout(item_layout)
         item_layout = QHBoxLayout()
+        item_layout.addSpacing(_spacer_width)
+        item_layout.addWidget(QLabel('Layer detection:'))
+        item_layout.addWidget(self._inputs['layer_method'])
+        item_layout.addWidget(QLabel('Penalty:'))
+        item_layout.addWidget(self._inputs['changepoint_penalty'])
+        pre_smp_layout.addLayout(item_layout)
+        item_layout = QHBoxLayout()
         item_layout.addWidget(self._inputs['discard_thin_layers'])
         item_layout.addWidget(self._inputs['discard_layer_thickness'])
         item_layout.addWidget(QLabel('mm'))
@@ -6,10 +6,13 @@ from PyQt5.QtCore import QLocale, QRect, Qt, QSettings, QSize
 from PyQt5.QtGui import QIcon, QDoubleValidator, QValidator
 from PyQt5.QtWidgets import *
 from matplotlib.backends.backend_qt5 import NavigationToolbar2QT as NavigationToolbar
+import pandas as pd
 
 import snowmicropyn
+import snowmicropyn.batch
 import snowmicropyn.pyngui.icons
 import snowmicropyn.pyngui.kml
+import snowmicropyn.segmentation
 import snowmicropyn.tools
 from snowmicropyn.pyngui.document import Document
 from snowmicropyn.pyngui.globals import APP_NAME, VERSION, GITHASH
@@ -105,6 +108,7 @@ class MainWindow(QMainWindow):
         self.plot_drift_action = QAction('Plot Drift', self)
         self.detect_surface_action = QAction('Auto Detect Surface', self)
         self.detect_ground_action = QAction('Auto Detect Ground', self)
+        self.detect_layers_action = QAction('Auto Detect Layers', self)
         self.add_marker_action = QAction('New Marker', self)
         self.kml_action = QAction('Export to KML', self)
         self.show_log_action = QAction('Show Log', self)
@@ -209,6 +213,10 @@ class MainWindow(QMainWindow):
         action.setStatusTip('Auto Detection of Ground')
         action.triggered.connect(self._detect_ground_triggered)
 
+        action = self.detect_layers_action
+        action.setStatusTip('Auto Detection of Layer Boundaries (sets markers layer_1_top, layer_2_top, ...)')
+        action.triggered.connect(self._detect_layers_triggered)
+
         def force_plot():
             self.update()
 
@@ -339,6 +347,7 @@ class MainWindow(QMainWindow):
         menu = menubar.addMenu('&Profile')
         menu.addAction(self.detect_surface_action)
         menu.addAction(self.detect_ground_action)
+        menu.addAction(self.detect_layers_action)
         menu.addAction(self.add_marker_action)
 
         toolbar = self.addToolBar('Exit')
@@ -447,11 +456,23 @@ class MainWindow(QMainWindow):
         param = self.preferences.export_parameterization
         user_settings = self.export_dialog.confirmExportCAAML()
         if user_settings:
-            files=[]
-            for doc in self.documents:
-                samples_file = doc.export_caaml(parameterization=param, export_settings=user_settings)
-                files.append(samples_file)
-            self.notify_dialog.notifyFilesWritten(files)
+            dialog = QProgressDialog('Exporting CAAML files...', 'Cancel', 0, len(self.documents), self)
+            dialog.setWindowTitle('CAAML Export')
+            dialog.setWindowModality(Qt.WindowModal)
+            dialog.setMinimumDuration(0)
+            dialog.setValue(0)
+
+            def progress(done, total):
+                dialog.setValue(done)
+                return not dialog.wasCanceled()
+
+            summary = snowmicropyn.batch.export_caaml([doc.profile for doc in self.documents],
+                user_settings, param, progress=progress)
+            dialog.reset()
+            files = list(summary.outfile[summary.status == 'exported'])
+            failed = summary[summary.status == 'failed']
+            hint = '<br>'.join('Export of {} failed: {}'.format(row.file, row.error) for row in failed.itertuples())
+            self.notify_dialog.notifyFilesWritten(files, hint)
 
     def _export_niviz_triggered(self):
         export_settings = ExportSettings.load()
@@ -524,6 +545,20 @@ class MainWindow(QMainWindow):
         self.set_marker('ground', doc.profile.ground)
         self.update()
 
+    def _detect_layers_triggered(self):
+        doc = self.current_document
+        p = doc.profile
+        boundaries = snowmicropyn.segmentation.detect_layers(p)
+        # Update sidebar and plot for all markers at once and draw only in the end
+        for label in snowmicropyn.segmentation.layer_markers(p):
+            self.sidebar.set_marker(label, None)
+            self.plot_canvas.set_marker(label, None)
+        markers = snowmicropyn.segmentation.set_layer_markers(p, boundaries)
+        for label, value in markers.items():
+            self.sidebar.set_marker(label, value)
+            self.plot_canvas.set_marker(label, value)
+        self.plot_canvas.draw()
+
     def _detect_surface_triggered(self):
         doc = self.current_document
         doc.profile.detect_surface()
@@ -602,6 +637,7 @@ class MainWindow(QMainWindow):
         self.export_niviz_action.setEnabled(at_least_one)
         self.detect_surface_action.setEnabled(at_least_one)
         self.detect_ground_action.setEnabled(at_least_one)
+        self.detect_layers_action.setEnabled(at_least_one)
         self.add_marker_action.setEnabled(at_least_one)
         self.kml_action.setEnabled(at_least_one)
 
@@ -654,39 +690,26 @@ class MainWindow(QMainWindow):
 
     def calc_drift(self):
         p = self.current_document.profile
+        begin, end = p.drift_range()
 
-        try:
-            begin = p.marker('drift_begin')
-            begin_label = 'Marker drift_begin'
-        except KeyError:
-            # Skip the first few values of profile for drift calculation
-            begin = p.samples.distance.iloc[10]
-            begin_label = 'Begin of Profile'
-
-        try:
-            end = p.marker('drift_end')
+        # Name what drift_range() chose, for the sidebar
+        markers = p.markers
+        begin_label = 'Marker drift_begin' if 'drift_begin' in markers else 'Begin of Profile'
+        if 'drift_end' in markers:
             end_label = 'Marker drift_end'
-        except KeyError:
-            try:
-                end = p.marker('surface')
-                end_label = 'Marker surface'
-            except KeyError:
-                end = p.samples.distance.iloc[-1]
-                end_label = 'End of Profile'
+        elif 'surface' in markers:
+            end_label = 'Marker surface'
+        else:
+            end_label = 'End of Profile'
 
         log.debug('Calculating drift from {} to {}'.format(begin, end))
 
-        # Flip begin and end to make sure begin is always smaller then end
-        if end < begin:
-            begin, end = end, begin
-
-        drift_range = p.samples[p.samples.distance.between(begin, end)]
-
-        x_fit, y_fit, drift, offset, noise = snowmicropyn.tools.lin_fit(drift_range.distance,
-                                                                        drift_range.force)
+        drift, offset, noise = p.drift()
+        # The plot canvas expects pandas series (two points suffice for the line)
+        x_fit = pd.Series([min(begin, end), max(begin, end)])
         self.current_document._fit_x = x_fit
-        self.current_document._fit_y = y_fit
-        self.current_document._dirft = drift
+        self.current_document._fit_y = x_fit * drift + offset
+        self.current_document._drift = drift
         self.current_document._offset = offset
         self.current_document._noise = noise
 
@@ -3,6 +3,8 @@ import logging
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
 
+from snowmicropyn.tools import decimate_minmax
+
 log = logging.getLogger('snowmicropyn')
 
 
@@ -10,6 +12,8 @@ class SuperposCanvas(FigureCanvas):
 
     COLOR_ACTIVE = 'C0'
     COLOR_INACTIVE = 'C7'
+    # Profiles are drawn decimated to this many points (peaks are kept)
+    MAX_POINTS = 10000
 
     def __init__(self, main_window):
         self.main_window = main_window
@@ -34,11 +38,11 @@ class SuperposCanvas(FigureCanvas):
     def add_doc(self, doc):
         pro = doc.profile
 
-        lines = self.axes.plot(pro.samples.distance, pro.samples.force)
+        lines = self.axes.plot(*decimate_minmax(pro.samples.distance, pro.samples.force, self.MAX_POINTS))
         self._lines[pro.name] = lines
 
         samples_sp = doc.profile.samples_within_snowpack()
-        airgap_lines = self.airgap_axes.plot(samples_sp.distance, samples_sp.force)
+        airgap_lines = self.airgap_axes.plot(*decimate_minmax(samples_sp.distance, samples_sp.force, self.MAX_POINTS))
         self._airgap_lines[pro.name] = airgap_lines
 
         self.airgap_axes.relim()
@@ -0,0 +1,206 @@
+"""Layer segmentation by change point detection.
+
+This module splits an SMP signal into layers by finding the points where
+the statistical properties of the signal change. It implements the Pruned
+Exact Linear Time (PELT) algorithm described in
+`Optimal detection of changepoints with a linear computational cost
+<https://doi.org/10.1080/01621459.2012.737745>`_ by Rebecca Killick, Paul
+Fearnhead and Idris A. Eckley, publicised in `Journal of the American
+Statistical Association <https://www.tandfonline.com/toc/uasa20/current>`_,
+Volume 107, Issue 500, 2012.
+
+Each segment is modelled as normally distributed with its own mean and
+variance. The cost of a segment is evaluated from prefix sums in constant
+time, so that together with the pruning the search runs in close to linear
+time. The default penalty assumes independent samples. Neighbouring force
+samples are strongly correlated at the SMP's resolution, so the force is
+averaged over bins before the search; otherwise every few millimetres would
+become a layer of its own.
+"""
+
+import logging
+import re
+
+import numpy as np
+
+log = logging.getLogger('snowmicropyn')
+
+#: Markers set by :func:`set_layer_markers` are named like this.
+LAYER_MARKER_FORMAT = 'layer_{}_top'
+_layer_marker_regex = re.compile(r'^layer_\d+_top$')
+
+
+class _NormalMeanVarCost:
+    """Segment cost for a change in mean and variance of normally distributed data.
+
+    The cost of the segment ``[begin, end)`` is the sum over all columns of
+    ``n * log(variance)``, i. e. twice the negative maximum log likelihood up
+    to a constant. Sums and sums of squares are kept as prefix sums.
+    """
+
+    def __init__(self, signal):
+        signal = np.asarray(signal, dtype=float)
+        if signal.ndim == 1:
+            signal = signal[:, np.newaxis]
+        # Centering keeps the prefix sums well conditioned
+        signal = signal - signal.mean(axis=0)
+        zeros = np.zeros((1, signal.shape[1]))
+        self._sum = np.concatenate([zeros, np.cumsum(signal, axis=0)])
+        self._sum_sq = np.concatenate([zeros, np.cumsum(signal ** 2, axis=0)])
+        # Variance floor to keep constant stretches (e. g. clipped forces) finite
+        self._min_var = max(np.finfo(float).eps * signal.var(axis=0).max(), np.finfo(float).tiny)
+
+    def __call__(self, begins, end):
+        nn = (end - begins)[:, np.newaxis]
+        sums = self._sum[end] - self._sum[begins]
+        sums_sq = self._sum_sq[end] - self._sum_sq[begins]
+        var = np.maximum((sums_sq - sums ** 2 / nn) / nn, self._min_var)
+        return (nn * np.log(var)).sum(axis=1)
+
+
+def pelt(signal, penalty=None, min_size=2, jump=1):
+    """Find change points in a signal with the PELT algorithm.
+
+    :param signal: Numpy array of shape (n,) or (n, d) with d observables.
+    :param penalty: Cost of adding a change point. The default is the Bayesian
+           information criterion ``(2 * d + 1) * log(n)``. Higher values
+           yield fewer layers.
+    :param min_size: Minimal number of samples per segment.
+    :param jump: Only every jump-th sample is considered as a change point,
+           which speeds up the search on long signals.
+    :return: Sorted numpy array of the indices where new segments begin (the
+             first segment at index 0 is not included).
+    """
+    cost = _NormalMeanVarCost(signal)
+    n = cost._sum.shape[0] - 1
+    dims = cost._sum.shape[1]
+    if penalty is None:
+        penalty = (2 * dims + 1) * np.log(max(n, 2))
+    min_size = max(int(min_size), 1)
+    jump = max(int(jump), 1)
+    if n < 2 * min_size:
+        return np.array([], dtype=int)
+
+    # Candidate ends: multiples of jump (and the very end of the signal)
+    ends = np.arange(min_size, n + 1)
+    ends = ends[(ends % jump == 0) | (ends == n)]
+
+    best = np.full(n + 1, np.inf)
+    best[0] = -penalty
+    last = np.zeros(n + 1, dtype=int)
+    candidates = np.array([0])
+    admissible = 0 # position in ends of the next candidate to become admissible
+
+    for end in ends:
+        # New candidates are all former ends leaving room for min_size samples
+        while admissible < len(ends) and ends[admissible] <= end - min_size:
+            candidates = np.append(candidates, ends[admissible])
+            admissible += 1
+        total = best[candidates] + cost(candidates, end)
+        ii = np.argmin(total)
+        best[end] = total[ii] + penalty
+        last[end] = candidates[ii]
+        # Pruning: candidates that can never be optimal again
+        candidates = candidates[total <= best[end]]
+
+    change_points = []
+    pos = last[n]
+    while pos > 0:
+        change_points.append(pos)
+        pos = last[pos]
+    return np.array(change_points[::-1], dtype=int)
+
+
+def _bin_means(values, size):
+    """Means of consecutive bins of size values (the last bin may be shorter)."""
+    edges = np.arange(0, len(values), size)
+    counts = np.diff(np.append(edges, len(values)))
+    return np.add.reduceat(values, edges) / counts
+
+
+def segment_samples(samples, penalty=None, min_thickness=1, resolution=0.5):
+    """Layer boundaries from the raw force signal.
+
+    The force is averaged over bins of ``resolution`` mm, which are then
+    segmented by :func:`pelt`. The bin width is also the resolution of the
+    boundaries.
+
+    :param samples: Pandas dataframe with the columns 'distance' and 'force'.
+    :param penalty: Cost of adding a layer, see :func:`pelt`. The default
+           is the Bayesian information criterion for the number of bins.
+           Higher values yield fewer layers.
+    :param min_thickness: Minimal thickness of a layer in mm (at least two bins).
+    :param resolution: Bin width in mm.
+    :return: Numpy array with the distances where layers begin.
+    """
+    distance = samples.distance.values
+    if len(distance) < 2:
+        return np.array([])
+    spatial_res = np.median(np.diff(distance))
+    size = max(int(round(resolution / spatial_res)), 1)
+    min_size = max(int(round(min_thickness / (size * spatial_res))), 2)
+    change_points = pelt(_bin_means(samples.force.values.astype(float), size), penalty, min_size)
+    return distance[change_points * size]
+
+
+def segment_derivatives(derivatives, columns=None, penalty=None, min_size=2):
+    """Layer boundaries from derived quantities.
+
+    :param derivatives: Pandas dataframe with derived SMP quantities (one row per window)
+           including the column 'distance'.
+    :param columns: Columns to consider. By default all columns except 'distance'
+           and 'grain_shape' are used.
+    :param penalty: Cost of adding a layer, see :func:`pelt`.
+    :param min_size: Minimal number of rows per layer.
+    :return: Numpy array with the row indices where layers begin.
+    """
+    if columns is None:
+        columns = [col for col in derivatives.columns if col not in ('distance', 'grain_shape')]
+    values = derivatives[columns].to_numpy(dtype=float)
+    values = values[:, np.isfinite(values).all(axis=0)] # a single nan would spoil the prefix sums
+    if values.shape[1] == 0:
+        return np.array([], dtype=int)
+    return pelt(values, penalty, min_size)
+
+
+def detect_layers(profile, penalty=None, min_thickness=1, resolution=0.5):
+    """Layer boundaries within the snowpack of a profile.
+
+    :param profile: A :class:`snowmicropyn.Profile`.
+    :param penalty: Cost of adding a layer, see :func:`pelt`.
+    :param min_thickness: Minimal thickness of a layer in mm, see :func:`segment_samples`.
+    :param resolution: Resolution of the boundaries in mm, see :func:`segment_samples`.
+    :return: Numpy array with the distances where layers begin (same distance
+             axis as the profile's samples).
+    """
+    samples = profile.samples_within_snowpack(relativize=False)
+    boundaries = segment_samples(samples, penalty, min_thickness, resolution)
+    log.info('Detected {} layer boundaries in profile {}'.format(len(boundaries), profile))
+    return boundaries
+
+
+def layer_markers(profile):
+    """Names of the markers previously set by :func:`set_layer_markers`.
+
+    :param profile: A :class:`snowmicropyn.Profile`.
+    :return: List of marker names.
+    """
+    return [label for label in profile.markers if _layer_marker_regex.match(label)]
+
+
+def set_layer_markers(profile, boundaries):
+    """Store layer boundaries as markers on a profile.
+
+    Markers from an earlier segmentation are removed. The new markers are
+    named ``layer_1_top``, ``layer_2_top``, ... (see :const:`LAYER_MARKER_FORMAT`).
+
+    :param profile: A :class:`snowmicropyn.Profile`.
+    :param boundaries: Iterable of distances.
+    :return: Dictionary of the markers that were set.
+    """
+    for label in layer_markers(profile):
+        profile.remove_marker(label)
+    markers = {LAYER_MARKER_FORMAT.format(ii + 1): float(bb) for ii, bb in enumerate(sorted(boundaries))}
+    for label, value in markers.items():
+        profile.set_marker(label, value)
+    return markers
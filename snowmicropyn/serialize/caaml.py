@@ -2,12 +2,20 @@
 forces and derived quantities to an XML. It also handles the calculations and
 parameterizations necessary to build a CAAML stratigraphy profile."""
 
+import contextlib
+import functools
 import logging
+import numpy as np
+import os
 import pandas as pd
+import pathlib
 from scipy.ndimage import gaussian_filter
 from scipy.optimize import curve_fit
+import threading
 import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
 
+from snowmicropyn import segmentation
 from snowmicropyn.pyngui.globals import VERSION
 
 log = logging.getLogger('snowmicropyn')
@@ -33,9 +41,9 @@ def _get_parameterization_name(derivatives):
 def hand_hardness(smp_force, method='regression'):
     """Parameterization of the measured SMP forces to hand hardness index.
 
-    param smp_force: Penetration force as measured by the SMP in N.
+    param smp_force: Penetration force as measured by the SMP in N (number or numpy array).
     param method: Method of parameterization as string identifier (e. g. 'regression').
-    returns: Hand hardness index.
+    returns: Hand hardness index (numpy array for an array of forces).
     """
     if method == 'naive':
         return hand_hardness_naive(smp_force)
@@ -45,34 +53,61 @@ def hand_hardness(smp_force, method='regression'):
 def hand_hardness_label(smp_force, method='regression'):
     """Parameterization of the measured SMP forces to hand hardness label.
 
-    param smp_force: Penetration force as measured by the SMP in N.
-    returns: Hand hardness as a text label.
+    param smp_force: Penetration force as measured by the SMP in N (number or array-like,
+    e. g. a whole force column).
+    returns: Hand hardness as a text label (numpy array of labels for an array of forces).
     """
+    if np.ndim(smp_force) > 0:
+        smp_force = np.asarray(smp_force, dtype=float)
     idx = hand_hardness(smp_force, method)
     return _hardness_index_to_identifier(idx)
 
+# Hand hardness labels for the indices 1, 1.5, 2, ..., 6:
+_hardness_labels = np.array(['F-', 'F+', '4F', '4F+', '1F', '1F+', 'P', 'P+', 'K', 'K+', 'I'])
+
 def _hardness_index_to_identifier(index):
     """Numeric hand hardness index to text label.
 
-    param index: Hand hardness index (int or float).
-    returns: Text label for hand hardness index.
+    param index: Hand hardness index (int or float) or numpy array of indices.
+    returns: Text label for hand hardness index (numpy array of labels for an array).
     """
-    id_map = {1: 'F-', 1.5: 'F+', 2: '4F', 2.5: '4F+', 3: '1F', 3.5: '1F+',
-        4: 'P', 4.5: 'P+', 5: 'K', 5.5: 'K+', 6: 'I'}
-    if index < 1:
-        index = 1
-    elif index > 6:
-        index = 6
-    index = round(index * 2) / 2 # round to .5
-    return id_map[index]
+    index = np.clip(index, 1, 6)
+    if np.isnan(index).any():
+        raise ValueError('Hand hardness index is not a number.')
+    pos = np.round(index * 2).astype(int) - 2 # round to .5
+    labels = _hardness_labels[pos]
+    return labels if np.ndim(labels) > 0 else str(labels)
+
+def _hardness_identifier_to_index(label):
+    """Hand hardness label (as found in manual profiles) to numeric index.
 
+    A trailing '+' or '-' adds or subtracts a third. For ranges like '4F-1F'
+    the mean of both ends is returned.
+
+    param label: Hand hardness as text label (e. g. '1F+').
+    returns: Hand hardness index as float, nan if the label is not recognized.
+    """
+    base_map = {'F': 1, '4F': 2, '1F': 3, 'P': 4, 'K': 5, 'I': 6}
+    if not isinstance(label, str):
+        return np.nan
+    label = label.strip().upper()
+    if label in base_map:
+        return float(base_map[label])
+    if label[:-1] in base_map and label[-1] in '+-':
+        return base_map[label[:-1]] + (1 / 3 if label[-1] == '+' else -1 / 3)
+    for pos in range(1, len(label) - 1): # range, the dash may also be part of the first label
+        if label[pos] == '-' and label[:pos] in base_map and label[pos + 1:] in base_map:
+            return (base_map[label[:pos]] + base_map[label[pos + 1:]]) / 2
+    return np.nan
+
+@functools.lru_cache(maxsize=None)
 def _get_hardness_fit(recalc=False):
     """Parameterization through regression (measured SMP force and hand hardness index).
     Data points provided by van Herwijnen, Pielmeier: Characterizing Snow Stratigraphy:
     a Comparison of SP2, Snowmicropen, Ramsonde and Hand Hardness Profiles, ISSW Proceedings 2016
 
     param recalc: Set to True to reproduce the fit parameters on the fly.
-    returns: Fitted function as function object.
+    returns: Fitted function as function object (built once and cached).
     """
     hardness_func = lambda xx, aa, bb : aa * xx**bb # use a power law fit
     if recalc:
@@ -92,7 +127,7 @@ def hand_hardness_regression(smp_force):
     """Parameterization method for hand hardness index.
     See above for implementation details.
 
-    param smp_force: The measured force in N.
+    param smp_force: The measured force in N (number or numpy array).
     returns: Hand hardness index.
     """
     fit_func = _get_hardness_fit()
@@ -103,21 +138,13 @@ def hand_hardness_naive(force):
     Mapping of N to hand hardness according to ICSSG p. 6. This can not
     be used directly with an SMP measurement.
 
-    param force: Penetration force measured by hand (not with an SMP).
+    param force: Penetration force measured by hand (not with an SMP), number or numpy array.
     returns: Hand hardness index.
     """
-    if force <= 50:
-        return 1 # fist
-    elif force <= 175:
-        return 2 # 4 fingers
-    elif force <= 390:
-        return 3 # 1 finger
-    elif force <= 715:
-        return 4 # pencil
-    elif force <= 1200:
-        return 5 # knife
-    else:
-        return 6 # ice (sometimes "-")
+    # Upper force limits of fist, 4 fingers, 1 finger, pencil and knife (above: ice, sometimes "-")
+    limits = [50, 175, 390, 715, 1200]
+    index = np.searchsorted(limits, force, side='left') + 1
+    return index if np.ndim(index) > 0 else int(index)
 
 def optical_thickness(ssa):
     """Calculation of a snow grain's diameter via the specific surface area as explained in
@@ -127,10 +154,12 @@ def optical_thickness(ssa):
     Research <https://agupubs.onlinelibrary.wiley.com/doi/abs/10.1029/1999JD900496>`_,
     Volume 104, 1999.
 
-    param ssa: Specific surface area in m^2/kg.
+    param ssa: Specific surface area in m^2/kg (number or numpy array).
     returns: Optical thickness ("diameter") of particle in m.
     """
     DENSITY_ICE = 917.
+    if np.ndim(ssa) > 0:
+        ssa = np.asarray(ssa, dtype=float)
     d_eff = 6 / (DENSITY_ICE * ssa) # r_eff=3V/A ==> d_eff=6/(rho_ice*SSA)
     return d_eff
 
@@ -177,6 +206,13 @@ def remove_negatives(derivatives):
         derivatives = pd.concat([derivatives, grain_col.to_frame()], axis=1)
     return derivatives
 
+def _layer_bounds(layer_start, length):
+    """Start and stop (exclusive) row indices of layers from a boolean array marking
+    the rows (except the first) that begin a new layer."""
+    starts = np.concatenate([[0], np.flatnonzero(layer_start) + 1]) if length > 0 else np.array([], dtype=int)
+    stops = np.append(starts[1:], length)
+    return starts, stops
+
 def _chunkup_derivs(derivatives, grain_shapes, similarity_percent):
     """Split up SMP data into regions where we can make a guess that the snow type is the same.
     Data rows are deemed to belong to the same layer if a) the grain shape is the same and
@@ -187,42 +223,53 @@ def _chunkup_derivs(derivatives, grain_shapes, similarity_percent):
     param similarity_percent: The quantities that are compared may be +/- this many percent
     compared to the previous data row in order to belong to the same layer.
     returns:
-      - List of pandas dataframes where each entry represents a layer in the stratigraphy
-        profile and contains a block of the original derivatives.
+      - Numpy array with the index of the first row of each layer in the stratigraphy profile.
+      - Numpy array with the index after the last row of each layer.
+      - List of grain shapes associated with each layer.
+    """
+    values = derivatives.iloc[:, 1:].to_numpy(dtype=float) # all but the distance
+    prev = values[:-1]
+    curr = values[1:]
+    # Is at least 1 value outside of the allowed range around its predecessor?
+    outside = (curr < prev * (100 - similarity_percent) / 100) | (curr > prev * (100 + similarity_percent) / 100)
+    layer_start = outside.any(axis=1)
+    shapes = []
+    if len(grain_shapes) > 0: # grain shape different --> different layer
+        shapes_arr = np.asarray(grain_shapes)
+        layer_start |= shapes_arr[1:] != shapes_arr[:-1]
+    starts, stops = _layer_bounds(layer_start, len(derivatives))
+    if len(grain_shapes) > 0:
+        shapes = shapes_arr[starts].tolist() # keep one list entry for the grain shape for each layer
+
+    log.info(f'CAAML export: Reduced sample size from {len(derivatives)} to {len(starts)} by merging layers')
+    return starts, stops, shapes
+
+def _chunkup_changepoints(derivatives, grain_shapes, penalty=None):
+    """Split up SMP data into layers at the change points of the derivatives.
+    A new layer begins where the PELT change point detection finds a change in the
+    low-level derivatives or where the grain shape changes.
+
+    param derivatives: Pandas dataframe with derived SMP quantities.
+    param grain_shapes: List of grain shapes (one entry per SMP data row).
+    param penalty: Penalty for adding a layer (None for the default of the segmentation module).
+    returns:
+      - Numpy array with the index of the first row of each layer in the stratigraphy profile.
+      - Numpy array with the index after the last row of each layer.
       - List of grain shapes associated with each layer.
     """
-    chunks = []
+    layer_start = np.zeros(max(len(derivatives) - 1, 0), dtype=bool)
+    layer_start[segmentation.segment_derivatives(derivatives, penalty=penalty) - 1] = True
     shapes = []
-    layer_start = 0
-
-    for ii in range(1, len(derivatives)): # run through rows (1st is always in 1st layer)
-        new = False
-
-        if len(grain_shapes) > 0 and grain_shapes[ii] != grain_shapes[ii - 1]: # grain shape different --> different layer
-            new = True
-
-        if not new: # same grain shape - check microparameters
-            all_within = True # are all values within a few % of their predecessors?
-            for jj in range(1, len(derivatives.columns)):
-                if derivatives.iat[ii, jj] < derivatives.iat[ii - 1, jj] * (100 - similarity_percent) / 100:
-                    all_within = False
-                    break
-                if derivatives.iat[ii, jj] > derivatives.iat[ii - 1, jj] * (100 + similarity_percent) / 100:
-                    all_within = False
-                    break
-            if not all_within: # at least 1 value is outside of our allowed range --> different layer
-                new = True
-
-        if new or ii == len(derivatives) - 1:
-            chunks.append(derivatives.iloc[layer_start:ii]) # start of last layer to previous element
-            if len(grain_shapes) > 0:
-                shapes.append(grain_shapes[ii - 1]) # keep one list entry for the grain shape for each layer
-            layer_start = ii # current element is start of new layer
-
-    log.info(f'CAAML export: Reduced sample size from {len(derivatives)} to {len(chunks)} by merging layers')
-    return chunks, shapes
-
-def merge_layers(derivatives, grain_shapes, similarity_percent):
+    if len(grain_shapes) > 0:
+        shapes_arr = np.asarray(grain_shapes)
+        layer_start |= shapes_arr[1:] != shapes_arr[:-1]
+    starts, stops = _layer_bounds(layer_start, len(derivatives))
+    if len(grain_shapes) > 0:
+        shapes = shapes_arr[starts].tolist()
+    log.info(f'CAAML export: Reduced sample size from {len(derivatives)} to {len(starts)} by change point detection')
+    return starts, stops, shapes
+
+def merge_layers(derivatives, grain_shapes, similarity_percent, method='similarity', penalty=None):
     """Merge multiple SMP data rows to single snow profile layers.
     Data rows are deemed to belong to the same layer if a) the grain shape is the same and
     b) low-level derivatives do not differ too greatly.
@@ -230,6 +277,9 @@ def merge_layers(derivatives, grain_shapes, similarity_percent):
     param derivatives: Pandas dataframe with derived SMP quantities.
     param grain_shapes: List of grain shapes (one entry per SMP data row).
     param similarity_percent: The quantities that are compared may be +/- this many percent
+    param method: 'similarity' to compare neighbouring rows with similarity_percent, or
+    'changepoint' to split at the change points found by the segmentation module.
+    param penalty: Penalty for adding a layer with the 'changepoint' method.
     returns:
       - Pandas dataframe in the shape of the original derivatives, but resampled via
         averaging over each separate layer.
@@ -237,14 +287,22 @@ def merge_layers(derivatives, grain_shapes, similarity_percent):
       - Penetration depth at the end of the profile (in order to be able to calculate the
         thickness of the last layer).
     """
-    chunks, shapes = _chunkup_derivs(derivatives, grain_shapes, similarity_percent)
-    merged = pd.DataFrame()
-    for chunk in chunks:
-        top = chunk.iloc[0].distance
-        med = chunk.median() # average all measured values (use median like for the force)...
-        med.distance = top # ... except for the distance, which will now represent "top of layer"
-        merged = pd.concat([merged, med.to_frame().T], ignore_index=True) # rebuild single data frame
-    bottom = chunks[-1].iloc[-1].distance # throw away chunks but remember the full profile depth
+    if len(grain_shapes) > 0 and len(grain_shapes) != len(derivatives):
+        raise ValueError(f'CAAML export: {len(grain_shapes)} grain shapes given for {len(derivatives)} data rows.')
+    if method == 'similarity':
+        starts, stops, shapes = _chunkup_derivs(derivatives, grain_shapes, similarity_percent)
+    elif method == 'changepoint':
+        starts, stops, shapes = _chunkup_changepoints(derivatives, grain_shapes, penalty)
+    else:
+        raise ValueError(f'Layer merging method "{method}" is not available.')
+    # One group label per data row, all layers are reduced at once:
+    labels = np.repeat(np.arange(len(starts)), stops - starts)
+    # Average all measured values (use median like for the force)...
+    merged = derivatives.groupby(labels, sort=False).median()
+    # ... except for the distance, which will now represent "top of layer"
+    merged['distance'] = derivatives['distance'].to_numpy()[starts]
+    merged.reset_index(drop=True, inplace=True)
+    bottom = derivatives['distance'].iat[stops[-1] - 1] # remember the full profile depth
     return merged, shapes, bottom
 
 def discard_thin_layers(derivatives, grain_shapes, profile_bottom, min_thickness):
@@ -259,20 +317,14 @@ def discard_thin_layers(derivatives, grain_shapes, profile_bottom, min_thickness
       - List of grain shapes associated with each layer.
       - Depth at the end of the profile (bottom layers may have been merged/removed).
     """
-    drop_indices = [] # list of indices to drop in the end
-    update_bottom = False # can only become True in last iteration
-    for idx, row in derivatives.iterrows():
-        if idx == len(derivatives) - 1: # last layer
-            thickness = profile_bottom - row.distance
-            update_bottom = True # if the layer is removed we will move the bottom
-        else:
-            thickness = derivatives['distance'][idx + 1] - row.distance
-        if thickness < min_thickness:
-            drop_indices.append(idx)
-            if update_bottom:
-                profile_bottom = row.distance # it was the last layer
-    derivatives.drop(drop_indices, inplace=True)
-    derivatives.reset_index(inplace=True)
+    tops = derivatives['distance'].to_numpy()
+    bottoms = np.append(tops[1:], profile_bottom) # the last layer ends at the profile bottom
+    thin = (bottoms - tops) < min_thickness
+    if len(thin) > 0 and thin[-1]:
+        profile_bottom = tops[-1] # the last layer is removed, move the bottom
+    if len(grain_shapes) == len(thin):
+        grain_shapes = [shape for shape, drop in zip(grain_shapes, thin) if not drop]
+    derivatives = derivatives[~thin].reset_index(drop=True)
     return derivatives, grain_shapes, profile_bottom
 
 def preprocess_lowlevel(derivatives, export_settings):
@@ -301,7 +353,8 @@ def preprocess_layers(derivatives, grain_shapes, export_settings):
     param derivatives: Pandas dataframe with derived SMP quantities.
     param grain_shapes: List of grain shapes (one entry per SMP data row).
     param export_settings: Dictionary with export settings. Relevant to this routine are
-    the settings 'merge_layers' (bool), 'discard_thin_layers' (bool)
+    the settings 'merge_layers' (bool), 'layer_method' ('similarity' or 'changepoint'),
+    'similarity_percent' (float), 'changepoint_penalty' (float), 'discard_thin_layers' (bool)
     and 'discard_layer_thickness' (float).
     returns:
       - Pandas dataframe with the pre-processed derivatives.
@@ -311,7 +364,11 @@ def preprocess_layers(derivatives, grain_shapes, export_settings):
     profile_bottom = derivatives.iloc[-1].distance # if nothing is merged/removed this will be the bottom
     if export_settings.get('merge_layers', False):
         sim_percent = float(export_settings.get('similarity_percent', 500))
-        derivatives, shapes, profile_bottom = merge_layers(derivatives, grain_shapes, sim_percent)
+        method = export_settings.get('layer_method') or 'similarity'
+        penalty = export_settings.get('changepoint_penalty')
+        penalty = float(penalty) if penalty else None
+        derivatives, grain_shapes, profile_bottom = merge_layers(derivatives, grain_shapes, sim_percent,
+            method, penalty)
     if export_settings.get('discard_thin_layers', False) and export_settings['discard_layer_thickness']:
         derivatives, grain_shapes, profile_bottom = discard_thin_layers(derivatives, grain_shapes,
             profile_bottom, float(export_settings['discard_layer_thickness']))
@@ -332,13 +389,14 @@ def export(settings, derivatives, grain_shapes, prof_id, timestamp, smp_serial,
     keys 'location_name', 'altitude', 'slope_exposition' and 'slope_angle'. In addition, please have a
     look at the subroutines that are called.
     param derivatives: Pandas dataframe with derived SMP quantities.
-    param grain_shapes: List of grain shapes (one entry per SMP data row).
+    param grain_shapes: List of grain shapes (one entry per row of the derivatives). They are
+    filtered together with the derivatives by the pre-processing.
     param prof_id: Profile id which will be written in the 'id' attribute.
     param timestamp: Date and time of measurement.
     param smp_serial: Serial number of the SMP device.
     param longitude: Longitude of point of measurement.
     param latitude: Latitude of point of measurement.
-    param outfile: Filename to save to.
+    param outfile: Filename to save to, or a text stream to write to.
     """
     mm2cm = lambda mm : mm / 10
     m2mm = lambda m : m * 1000
@@ -348,184 +406,335 @@ def export(settings, derivatives, grain_shapes, prof_id, timestamp, smp_serial,
     # We keep two sets of derivatives: one for the stratigraphy profile with merged layers and
     # one with only basic pre-processing for the embedded density, SSA and hardness profiles
     # (because we don't want only 1 data point per thick layer for the embedded profiles):
+    if len(grain_shapes) > 0: # filter the grain shapes with the same rows as the derivatives
+        if len(grain_shapes) != len(derivatives):
+            raise ValueError(f'CAAML export: {len(grain_shapes)} grain shapes given for {len(derivatives)} data rows.')
+        derivatives = derivatives.assign(grain_shape=np.asarray(grain_shapes))
     derivatives = preprocess_lowlevel(derivatives, settings)
+    if 'grain_shape' in derivatives:
+        grain_shapes = derivatives['grain_shape'].to_numpy()
+        derivatives = derivatives.drop('grain_shape', axis=1)
     layer_derivatives, grain_shapes, profile_bottom = preprocess_layers(derivatives,
         grain_shapes, settings)
 
-    # Meta data:
-    root = ET.Element(f'{_ns_caaml}:SnowProfile')
-    root.set(f'xmlns:{_ns_caaml}', _ns[_ns_caaml])
-    root.set(f'xmlns:{_ns_gml}', _ns[_ns_gml])
-    root.set(f'{_ns_gml}:id', prof_id)
-
-    meta_data = ET.SubElement(root, f'{_ns_caaml}:metaData')
-    _addGenericComments(meta_data, parameterization)
-
-    time_ref = ET.SubElement(root, f'{_ns_caaml}:timeRef')
-    rec_time = ET.SubElement(time_ref, f'{_ns_caaml}:recordTime')
-    time_inst = ET.SubElement(rec_time, f'{_ns_caaml}:TimeInstant')
-    time_pos = ET.SubElement(time_inst, f'{_ns_caaml}:timePosition')
-    time_pos.text = timestamp.isoformat()
-
-    src_ref = ET.SubElement(root, f'{_ns_caaml}:srcRef')
-    src_oper = ET.SubElement(src_ref, f'{_ns_caaml}:Operation')
-    src_oper.set(f'{_ns_gml}:id', 'SMP_serial')
-    src_name = ET.SubElement(src_oper, f'{_ns_caaml}:name')
-    src_name.text = smp_serial
-
-    loc_ref = ET.SubElement(root, f'{_ns_caaml}:locRef')
-    loc_ref.set(f'{_ns_gml}:id', 'LOC_ID')
-    loc_name = ET.SubElement(loc_ref, f'{_ns_caaml}:name')
-    loc_name.text = settings.get('location_name', 'SMP observation point')
-    obs_sub = ET.SubElement(loc_ref, f'{_ns_caaml}:obsPointSubType')
-    obs_sub.text = 'SMP profile location'
+    # Stratigraphy layers, each column is formatted at once:
+    c = _ns_caaml
+    tops = layer_derivatives['distance'].to_numpy(dtype=float)
+    thicknesses = np.diff(np.append(tops, profile_bottom)) # the last layer ends at the profile bottom
+    ssa = layer_derivatives[f'{parameterization}_ssa'].to_numpy(dtype=float)
+    layer_columns = [_format_column(mm2cm(tops)), _format_column(mm2cm(thicknesses))]
+    if len(grain_shapes) > 0: # we have grain classification available
+        layer_columns.append([_element_string(f'{c}:grainFormPrimary', shape) for shape in grain_shapes])
+    layer_columns.append(_format_column(m2mm(optical_thickness(ssa))))
+    layer_columns.append(hand_hardness_label(layer_derivatives['force_median']))
+
+    depths = _format_column(mm2cm(derivatives['distance'].to_numpy(dtype=float)))
+    densities = _format_column(derivatives[f'{parameterization}_density'])
+    ssa_tuples = _tuple_list(depths, _format_column(derivatives[f'{parameterization}_ssa']))
+    force_tuples = _tuple_list(depths, _format_column(mm2cm(derivatives['force_median'].to_numpy(dtype=float))))
+
     if altitude: # SMP altitude is in cm
         altitude = cm2m(altitude)
     else: # if no altitude is recorded by the SMP we insert the user chosen one
         altitude = settings.get('altitude')
-    if altitude:
-        valid_elevation = ET.SubElement(loc_ref, f'{_ns_caaml}:validElevation')
-        val_el_pos = ET.SubElement(valid_elevation, f'{_ns_caaml}:ElevationPosition')
-        val_el_pos.set('uom', 'm')
-        caaml_position = ET.SubElement(val_el_pos, f'{_ns_caaml}:position')
-        caaml_position.text = str(altitude)
-    valid_aspect = ET.SubElement(loc_ref, f'{_ns_caaml}:validAspect')
-    aspect_pos = ET.SubElement(valid_aspect, f'{_ns_caaml}:AspectPosition')
-    caaml_aspect = ET.SubElement(aspect_pos, f'{_ns_caaml}:position')
-    caaml_aspect.text = str(settings.get('slope_exposition', 0))
-    valid_slope_angle = ET.SubElement(loc_ref, f'{_ns_caaml}:validSlopeAngle')
-    valid_slope_angle = ET.SubElement(valid_slope_angle, f'{_ns_caaml}:SlopeAnglePosition')
-    valid_slope_angle.set('uom', 'deg')
-    caaml_angle = ET.SubElement(valid_slope_angle, f'{_ns_caaml}:position')
-    caaml_angle.text = str(settings.get('slope_angle', 0))
-
-    point_loc = ET.SubElement(loc_ref, f'{_ns_caaml}:pointLocation')
-    point_pt = ET.SubElement(point_loc, f'{_ns_gml}:Point')
-    point_pt.set(f'{_ns_gml}:id', 'pointID')
-    point_pt.set('srsName', 'urn:ogc:def:crs:OGC:1.3:CRS84')
-    point_pt.set('srsDimension', '2')
-    point_pos = ET.SubElement(point_pt, f'{_ns_gml}:pos')
-    point_pos.text = f'{longitude} {latitude}'
-
-    # Stratigraphy profile:
-    snow_prof = ET.SubElement(root, f'{_ns_caaml}:snowProfileResultsOf')
-    snow_prof_meas = ET.SubElement(snow_prof, f'{_ns_caaml}:SnowProfileMeasurements')
-    snow_prof_meas.set('dir', 'top down')
-    strat_prof = ET.SubElement(snow_prof_meas, f'{_ns_caaml}:stratProfile')
-    strat_meta = ET.SubElement(strat_prof, f'{_ns_caaml}:stratMetaData')
-
-    for idx, row in layer_derivatives.iterrows():
-        layer = ET.SubElement(strat_prof, f'{_ns_caaml}:Layer')
-        depth_top = ET.SubElement(layer, f'{_ns_caaml}:depthTop')
-        depth_top.set('uom', 'cm')
-        depth_top.text = str(mm2cm(row['distance']))
-        thickness = ET.SubElement(layer, f'{_ns_caaml}:thickness')
-        thickness.set('uom', 'cm')
-        if idx == len(layer_derivatives) - 1:
-            layer_thickness = profile_bottom - row.distance
-        else:
-            layer_thickness = layer_derivatives.distance[idx + 1] - row.distance
-        thickness.text = str(mm2cm(layer_thickness))
-        if len(grain_shapes) > 0: # we have grain classification available
-            grain_primary = ET.SubElement(layer, f'{_ns_caaml}:grainFormPrimary')
-            grain_primary.text = grain_shapes[idx]
-        grain_size = ET.SubElement(layer, f'{_ns_caaml}:grainSize')
-        grain_size.set('uom', 'mm')
-        grain_components = ET.SubElement(grain_size, f'{_ns_caaml}:Components')
-        grain_sz_avg = ET.SubElement(grain_components, f'{_ns_caaml}:avg')
-        grain_sz_avg.text = str(m2mm(optical_thickness(row[f'{parameterization}_ssa'])))
-        grain_hardness = ET.SubElement(layer, f'{_ns_caaml}:hardness')
-        grain_hardness.set('uom', '')
-        grain_hardness.text = hand_hardness_label(row['force_median'])
-
-    # Density profile:
-    dens_prof = ET.SubElement(snow_prof_meas, f'{_ns_caaml}:densityProfile')
-    dens_meta = ET.SubElement(dens_prof, f'{_ns_caaml}:densityMetaData')
-    dens_meth = ET.SubElement(dens_meta, f'{_ns_caaml}:methodOfMeas')
-    dens_meth.text = "other"
-
-    for _, row in derivatives.iterrows():
-        layer = ET.SubElement(dens_prof, f'{_ns_caaml}:Layer')
-        depth_top = ET.SubElement(layer, f'{_ns_caaml}:depthTop')
-        depth_top.set('uom', 'cm')
-        depth_top.text = str(mm2cm(row['distance']))
-        density = ET.SubElement(layer, f'{_ns_caaml}:density')
-        density.set('uom', 'kgm-3')
-        density_val = row[f'{parameterization}_density']
-        density.text = str(density_val)
-
-    # Specific surface area profile:
-    ssa_prof = ET.SubElement(snow_prof_meas, f'{_ns_caaml}:specSurfAreaProfile')
-    ssa_meta = ET.SubElement(ssa_prof, f'{_ns_caaml}:specSurfAreaMetaData')
-    ssa_meth = ET.SubElement(ssa_meta, f'{_ns_caaml}:methodOfMeas')
-    ssa_meth.text = "other"
-    ssa_comp = ET.SubElement(ssa_prof, f'{_ns_caaml}:MeasurementComponents')
-    ssa_comp.set('uomDepth', 'cm')
-    ssa_comp.set('uomSpecSurfArea', 'm2kg-1')
-    ssa_depth = ET.SubElement(ssa_comp, f'{_ns_caaml}:depth')
-    ssa_res = ET.SubElement(ssa_comp, f'{_ns_caaml}:specSurfArea')
-    ssa_meas = ET.SubElement(ssa_prof, f'{_ns_caaml}:Measurements')
-    ssa_tuple = ET.SubElement(ssa_meas, f'{_ns_caaml}:tupleList')
-
-    tuple_list = ''
-    for _, row in derivatives.iterrows():
-        tuple_list = tuple_list + str(mm2cm(row['distance'])) + "," + str(row[f'{parameterization}_ssa']) + " "
-    ssa_tuple.text = tuple_list
-
-    # Hardness profile:
-    hard_prof = ET.SubElement(snow_prof_meas, f'{_ns_caaml}:hardnessProfile')
-    hard_meta = ET.SubElement(hard_prof, f'{_ns_caaml}:hardnessMetaData')
-    hard_meth = ET.SubElement(hard_meta, f'{_ns_caaml}:methodOfMeas')
-    hard_meth.text = "SnowMicroPen"
-    hard_comp = ET.SubElement(hard_prof, f'{_ns_caaml}:MeasurementComponents')
-    hard_comp.set('uomDepth', 'cm')
-    hard_comp.set('uomHardness', 'N')
-    hard_depth = ET.SubElement(hard_comp, f'{_ns_caaml}:depth')
-    hard_res = ET.SubElement(hard_comp, f'{_ns_caaml}:penRes')
-    hard_meas = ET.SubElement(hard_prof, f'{_ns_caaml}:Measurements')
-    hard_tuple = ET.SubElement(hard_meas, f'{_ns_caaml}:tupleList')
-
-    tuple_list = ''
-    for _, row in derivatives.iterrows():
-        tuple_list = tuple_list + str(mm2cm(row['distance'])) + "," + str(mm2cm(row['force_median'])) + " "
-    hard_tuple.text = tuple_list
-
-    tree = ET.ElementTree(root)
-    ET.indent(tree, space="\t", level=0) # human-readable CAAML
-    tree.write(outfile, encoding="UTF-8", xml_declaration=True)
-
-def _addGenericComments(cmt_root, parameterization: str):
-    caaml_cmt = ET.SubElement(cmt_root, f'{_ns_caaml}:comment')
+
+    if hasattr(outfile, 'write'):
+        stream = contextlib.nullcontext(outfile) # the caller closes the stream
+    else:
+        stream = open(outfile, 'w', encoding='UTF-8', newline='\n')
+    with stream as stream:
+        stream.write("<?xml version='1.0' encoding='UTF-8'?>\n")
+        xml = _XmlWriter(stream)
+
+        # Meta data:
+        xml.start(f'{c}:SnowProfile', {f'xmlns:{_ns_caaml}': _ns[_ns_caaml], f'xmlns:{_ns_gml}': _ns[_ns_gml],
+            f'{_ns_gml}:id': prof_id})
+        xml.start(f'{c}:metaData')
+        _addGenericComments(xml, parameterization)
+        xml.end()
+
+        xml.start(f'{c}:timeRef')
+        xml.start(f'{c}:recordTime')
+        xml.start(f'{c}:TimeInstant')
+        xml.element(f'{c}:timePosition', timestamp.isoformat())
+        xml.end()
+        xml.end()
+        xml.end()
+
+        xml.start(f'{c}:srcRef')
+        xml.start(f'{c}:Operation', {f'{_ns_gml}:id': 'SMP_serial'})
+        xml.element(f'{c}:name', smp_serial)
+        xml.end()
+        xml.end()
+
+        xml.start(f'{c}:locRef', {f'{_ns_gml}:id': 'LOC_ID'})
+        xml.element(f'{c}:name', settings.get('location_name', 'SMP observation point'))
+        xml.element(f'{c}:obsPointSubType', 'SMP profile location')
+        if altitude:
+            xml.start(f'{c}:validElevation')
+            xml.start(f'{c}:ElevationPosition', {'uom': 'm'})
+            xml.element(f'{c}:position', altitude)
+            xml.end()
+            xml.end()
+        xml.start(f'{c}:validAspect')
+        xml.start(f'{c}:AspectPosition')
+        xml.element(f'{c}:position', settings.get('slope_exposition', 0))
+        xml.end()
+        xml.end()
+        xml.start(f'{c}:validSlopeAngle')
+        xml.start(f'{c}:SlopeAnglePosition', {'uom': 'deg'})
+        xml.element(f'{c}:position', settings.get('slope_angle', 0))
+        xml.end()
+        xml.end()
+        xml.start(f'{c}:pointLocation')
+        xml.start(f'{_ns_gml}:Point', {f'{_ns_gml}:id': 'pointID', 'srsName': 'urn:ogc:def:crs:OGC:1.3:CRS84',
+            'srsDimension': '2'})
+        xml.element(f'{_ns_gml}:pos', f'{longitude} {latitude}')
+        xml.end()
+        xml.end()
+        xml.end() # locRef
+
+        # Stratigraphy profile:
+        xml.start(f'{c}:snowProfileResultsOf')
+        xml.start(f'{c}:SnowProfileMeasurements', {'dir': 'top down'})
+        xml.start(f'{c}:stratProfile')
+        xml.element(f'{c}:stratMetaData')
+        ind = xml.indentation
+        layer_template = (f'\n{ind}<{c}:Layer>'
+            f'\n{ind}\t<{c}:depthTop uom="cm">{{}}</{c}:depthTop>'
+            f'\n{ind}\t<{c}:thickness uom="cm">{{}}</{c}:thickness>'
+            + (f'\n{ind}\t{{}}' if len(grain_shapes) > 0 else '') +
+            f'\n{ind}\t<{c}:grainSize uom="mm">'
+            f'\n{ind}\t\t<{c}:Components>'
+            f'\n{ind}\t\t\t<{c}:avg>{{}}</{c}:avg>'
+            f'\n{ind}\t\t</{c}:Components>'
+            f'\n{ind}\t</{c}:grainSize>'
+            f'\n{ind}\t<{c}:hardness uom="">{{}}</{c}:hardness>'
+            f'\n{ind}</{c}:Layer>')
+        xml.write_block(''.join(map(layer_template.format, *layer_columns)))
+        xml.end()
+
+        # Density profile:
+        xml.start(f'{c}:densityProfile')
+        xml.start(f'{c}:densityMetaData')
+        xml.element(f'{c}:methodOfMeas', 'other')
+        xml.end()
+        ind = xml.indentation
+        density_template = (f'\n{ind}<{c}:Layer>'
+            f'\n{ind}\t<{c}:depthTop uom="cm">{{}}</{c}:depthTop>'
+            f'\n{ind}\t<{c}:density uom="kgm-3">{{}}</{c}:density>'
+            f'\n{ind}</{c}:Layer>')
+        xml.write_block(''.join(map(density_template.format, depths, densities)))
+        xml.end()
+
+        # Specific surface area profile:
+        xml.start(f'{c}:specSurfAreaProfile')
+        xml.start(f'{c}:specSurfAreaMetaData')
+        xml.element(f'{c}:methodOfMeas', 'other')
+        xml.end()
+        xml.start(f'{c}:MeasurementComponents', {'uomDepth': 'cm', 'uomSpecSurfArea': 'm2kg-1'})
+        xml.element(f'{c}:depth')
+        xml.element(f'{c}:specSurfArea')
+        xml.end()
+        xml.start(f'{c}:Measurements')
+        xml.element(f'{c}:tupleList', ssa_tuples)
+        xml.end()
+        xml.end()
+
+        # Hardness profile:
+        xml.start(f'{c}:hardnessProfile')
+        xml.start(f'{c}:hardnessMetaData')
+        xml.element(f'{c}:methodOfMeas', 'SnowMicroPen')
+        xml.end()
+        xml.start(f'{c}:MeasurementComponents', {'uomDepth': 'cm', 'uomHardness': 'N'})
+        xml.element(f'{c}:depth')
+        xml.element(f'{c}:penRes')
+        xml.end()
+        xml.start(f'{c}:Measurements')
+        xml.element(f'{c}:tupleList', force_tuples)
+        xml.end()
+        xml.end()
+
+        xml.end() # SnowProfileMeasurements
+        xml.end() # snowProfileResultsOf
+        xml.end() # SnowProfile
+
+def _addGenericComments(xml, parameterization: str):
     cmt = f'This file was generated by snowmicropyn v{VERSION}: https://snowmicropyn.readthedocs.io/en/latest/. '
     cmt = cmt + f'All observables except for the SMP force and meta data are derived. Parameterization for density/SSA: "{parameterization}". '
     cmt = cmt + 'The SMP force signal contained here is preprocessed and downsampled (median force over a rolling window). Use csv export to obtain the raw SMP signal.'
-    caaml_cmt.text = cmt
+    xml.element(f'{_ns_caaml}:comment', cmt)
+
+def _format_column(values):
+    """Numeric values to strings (the same as str() of each value, but for a whole column at once).
+
+    param values: Array-like of numbers.
+    returns: Numpy array of strings.
+    """
+    return np.asarray(values, dtype=float).astype(str)
+
+def _tuple_list(depths, values):
+    """Text of a CAAML tupleList ('depth,value ' for each measurement).
 
-def parse_grainshape(caaml_file: str):
+    param depths: Numpy array of formatted depths.
+    param values: Numpy array of formatted values.
+    returns: The tuples as a single string.
+    """
+    return ''.join(np.char.add(np.char.add(depths, ','), np.char.add(values, ' ')))
+
+def _element_string(tag, text=None, attrib=None):
+    """A single XML element without children as string (escaped like ElementTree does it).
+
+    param tag: Tag of the element.
+    param text: Text content, the element is written as empty tag if there is none.
+    param attrib: Dictionary of attributes.
+    returns: The element as string.
+    """
+    if text is None or text == '':
+        return f'{_open_tag(tag, attrib)} />'
+    return f'{_open_tag(tag, attrib)}>{escape(str(text))}</{tag}>'
+
+def _open_tag(tag, attrib=None):
+    """Beginning of a start tag (without the closing bracket) with escaped attributes."""
+    attrs = ''.join(f' {key}="{escape(str(value), _attrib_entities)}"' for key, value in (attrib or {}).items())
+    return f'<{tag}{attrs}'
+
+_attrib_entities = {'"': '&quot;', '\n': '&#10;', '\r': '&#13;', '\t': '&#09;'}
+
+class _XmlWriter:
+    """Writes indented XML element by element to a text stream, so that the whole document
+    never has to be held in memory. The output is the same as the one of an indented
+    ElementTree."""
+
+    def __init__(self, stream, indent='\t'):
+        self._stream = stream
+        self._indent = indent
+        self._open = [] # tags of the elements that are not closed yet
+
+    @property
+    def indentation(self):
+        """Indentation of the next child element."""
+        return self._indent * len(self._open)
+
+    def _newline(self):
+        if self._open: # the root element follows the XML declaration directly
+            self._stream.write('\n' + self.indentation)
+
+    def start(self, tag, attrib=None):
+        """Open an element that will contain child elements."""
+        self._newline()
+        self._stream.write(_open_tag(tag, attrib) + '>')
+        self._open.append(tag)
+
+    def end(self):
+        """Close the last opened element."""
+        tag = self._open.pop()
+        self._stream.write(f'\n{self.indentation}</{tag}>')
+
+    def element(self, tag, text=None, attrib=None):
+        """Write an element without children."""
+        self._newline()
+        self._stream.write(_element_string(tag, text, attrib))
+
+    def write_block(self, block):
+        """Write preformatted elements, each starting with a line break and indentation."""
+        self._stream.write(block)
+
+_grainshape_columns = ['depthTop', 'thickness', 'grainFormPrimary', 'hardness']
+_grainshape_cache = {} # parsed files by (path, unit), see parse_grainshapes
+_grainshape_cache_lock = threading.Lock()
+
+def _to_float(text):
+    """Text of an XML element to float (nan if it is missing or not a number)."""
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return np.nan
+
+def parse_grainshape(caaml_file: str, unit=None):
     """Get the layers entered in a (manual) CAAML snow profile.
 
+    The file is parsed incrementally and only up to the end of the stratigraphy profile,
+    without building the whole XML tree.
+
     param caaml_file: Path to the CAAML file to parse.
-    returns: List of layers. Each item is itself a list containing information about
-    the depth and thickness of the layer as well as its grain shape.
+    param unit: Length unit for depth and thickness ('mm', 'cm' or 'm'). By default
+    the values are returned as they are written in the file.
+    returns: Pandas dataframe with one row per layer and the columns 'depthTop',
+    'thickness' (floats, nan if not available), 'grainFormPrimary' (categorical) and
+    'hardness' (None if not available).
     """
-    tree = ET.parse(caaml_file)
-    root = tree.getroot()
-    strat = root.find(f"{_ns_caaml}:snowProfileResultsOf", _ns)
-    strat = strat.find(f"{_ns_caaml}:SnowProfileMeasurements", _ns)
-    strat = strat.find(f"{_ns_caaml}:stratProfile", _ns)
-
-    extract_list = ["depthTop", "thickness", "grainFormPrimary"]
-    layer_list = []
-    for layer in strat.findall(f"{_ns_caaml}:Layer", _ns): # iterate through each snow layer
-        attr_list = []
-        for attr in extract_list:
-            val = layer.find(f"{_ns_caaml}:{attr}", _ns).text
-            try:
-                val = float(val) # store as float if it's a number
-            except:
-                pass
-            attr_list.append(val)
-        layer_list.append(attr_list)
-
-    return pd.DataFrame(layer_list, columns=extract_list)
-
+    to_mm = {'mm': 1, 'cm': 10, 'm': 1000}
+    caaml_tag = lambda name : f'{{{_ns[_ns_caaml]}}}{name}'
+    strat_tag = caaml_tag('stratProfile')
+    layer_tag = caaml_tag('Layer')
+    length_tags = {caaml_tag('depthTop'): 'depthTop', caaml_tag('thickness'): 'thickness'}
+    text_tags = {caaml_tag('grainFormPrimary'): 'grainFormPrimary', caaml_tag('hardness'): 'hardness'}
+
+    columns = {col: [] for col in _grainshape_columns}
+    found = False
+    in_strat = False
+    for event, el in ET.iterparse(caaml_file, events=('start', 'end')):
+        if el.tag == strat_tag:
+            if event == 'end': # nothing of interest after the stratigraphy profile
+                break
+            found = in_strat = True
+        elif in_strat and event == 'end' and el.tag == layer_tag:
+            layer = dict.fromkeys(_grainshape_columns)
+            for child in el: # iterate through the layer's attributes
+                if child.tag in length_tags:
+                    val = _to_float(child.text)
+                    if unit:
+                        val = val * to_mm[child.get('uom', unit)] / to_mm[unit]
+                    layer[length_tags[child.tag]] = val
+                elif child.tag in text_tags:
+                    layer[text_tags[child.tag]] = child.text
+            for col, val in layer.items():
+                columns[col].append(val)
+            el.clear() # the layer is not needed any more
+    if not found:
+        raise ValueError(f'No stratigraphy profile found in CAAML file "{caaml_file}".')
+
+    return pd.DataFrame({
+        'depthTop': pd.Series(columns['depthTop'], dtype=float),
+        'thickness': pd.Series(columns['thickness'], dtype=float),
+        'grainFormPrimary': pd.Categorical(columns['grainFormPrimary']),
+        'hardness': pd.Series(columns['hardness'], dtype=object),
+    })
+
+def parse_grainshapes(caaml_files, unit=None, cache=True):
+    """Get the layers of many (manual) CAAML snow profiles, see :func:`parse_grainshape`.
+
+    Parsed files are kept in a cache for the lifetime of the process. A file is
+    parsed again only if its modification time or size changed.
+
+    param caaml_files: Folder to search for CAAML files (including subfolders), a single
+    CAAML file or a list of CAAML files.
+    param unit: Length unit for depth and thickness ('mm', 'cm' or 'm').
+    param cache: Set to False to parse all files again.
+    returns: Dictionary with the file names (pathlib.Path) as keys and the layer
+    data frames as values.
+    """
+    if isinstance(caaml_files, (str, os.PathLike)):
+        path = pathlib.Path(caaml_files)
+        if path.is_dir():
+            files = sorted(ff for ff in path.rglob('*') if ff.suffix.lower() == '.caaml')
+        else:
+            files = [path]
+    else:
+        files = [pathlib.Path(ff) for ff in caaml_files]
+
+    layers = {}
+    for ff in files:
+        stat = ff.stat()
+        key = (str(ff.resolve()), unit)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        with _grainshape_cache_lock:
+            cached = _grainshape_cache.get(key) if cache else None
+        if cached is None or cached[0] != stamp:
+            cached = (stamp, parse_grainshape(ff, unit))
+            with _grainshape_cache_lock:
+                _grainshape_cache[key] = cached
+        layers[ff] = cached[1].copy() # callers may modify their frame
+    log.info(f'Parsed the layers of {len(files)} CAAML files')
+    return layers
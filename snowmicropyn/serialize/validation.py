@@ -0,0 +1,199 @@
+"""Validation of CAAML files against the CAAMLv6 SnowProfileIACS schema.
+
+The schema and all schemas it imports (e. g. GML) are downloaded once and
+kept in a local folder, so that later validations work offline. The compiled
+schema is kept for the lifetime of the process. Many files are validated by
+a pool of worker processes, each of which compiles the schema only once::
+
+    from snowmicropyn.serialize import validation
+
+    summary = validation.validate_files('/path/to/caaml/files')
+    print(summary[~summary.valid].explode('issues'))
+
+Exports that are not written to a file yet can be checked as well::
+
+    stream = io.StringIO()
+    caaml.export(settings, derivatives, grain_shapes, ..., stream)
+    issues = validation.validate(stream)
+"""
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import io
+import logging
+import os
+import pathlib
+import time
+import urllib.parse
+import urllib.request
+import xml.etree.ElementTree as ET
+
+from lxml import etree
+import pandas as pd
+
+from snowmicropyn.profile import _write_atomically
+
+log = logging.getLogger('snowmicropyn')
+
+#: Location of the CAAML schema exported files are validated against.
+SCHEMA_URL = 'http://caaml.org/Schemas/SnowProfileIACS/v6.0.3/CAAMLv6_SnowProfileIACS.xsd'
+
+#: Default folder for downloaded schemas.
+SCHEMA_FOLDER = pathlib.Path.home() / '.snowmicropyn' / 'schemas'
+
+#: A problem found in a CAAML file. Line and column refer to the validated
+#: document, type is the libxml2 error type (e. g. 'SCHEMAV_CVC_DATATYPE_VALID_1_2_1'
+#: or 'ERR_TAG_NAME_MISMATCH' for malformed XML).
+ValidationIssue = namedtuple('ValidationIssue', ['line', 'column', 'type', 'message', 'path'])
+
+_VALIDATION_COLUMNS = ['file', 'valid', 'issues', 'seconds']
+
+
+def _cached_file(url, schema_folder):
+    """Local copy of a downloaded schema file, fetched on first use."""
+    parts = urllib.parse.urlsplit(url)
+    folder = pathlib.Path(schema_folder).resolve()
+    local = (folder / parts.netloc / parts.path.lstrip('/')).resolve()
+    if folder not in local.parents: # e. g. '..' in the URL
+        raise ValueError(f'Schema location "{url}" can not be cached.')
+    if not local.exists():
+        log.info(f'Downloading schema {url} to {local}')
+        with urllib.request.urlopen(url, timeout=60) as response:
+            content = response.read()
+        local.parent.mkdir(parents=True, exist_ok=True)
+        _write_atomically(local, lambda ff: ff.write(content), mode='wb')
+    return local
+
+
+class _SchemaResolver(etree.Resolver):
+    """Serves imported schemas from the local schema folder (downloading them if needed)."""
+
+    def __init__(self, schema_folder):
+        super().__init__()
+        self._schema_folder = schema_folder
+
+    def resolve(self, url, pubid, context):
+        if urllib.parse.urlsplit(url).scheme not in ('http', 'https'):
+            return None # local files are loaded as usual
+        local = _cached_file(url, self._schema_folder)
+        # Keep the original URL as base so that relative imports are resolved through us as well
+        return self.resolve_string(local.read_bytes(), context, base_url=url)
+
+
+@functools.lru_cache(maxsize=None)
+def load_schema(schema_file=None, schema_folder=None):
+    """Compiled CAAML schema. It is compiled only once per process.
+
+    :param schema_file: Local schema file or URL. By default the CAAMLv6
+           SnowProfileIACS schema (:const:`SCHEMA_URL`) is used.
+    :param schema_folder: Folder to keep downloaded schemas in, by default
+           :const:`SCHEMA_FOLDER`.
+    :return: ``lxml.etree.XMLSchema`` object.
+    """
+    schema_file = str(schema_file or SCHEMA_URL)
+    schema_folder = schema_folder or SCHEMA_FOLDER
+    parser = etree.XMLParser()
+    parser.resolvers.add(_SchemaResolver(schema_folder))
+    if urllib.parse.urlsplit(schema_file).scheme in ('http', 'https'):
+        content = _cached_file(schema_file, schema_folder).read_bytes()
+        root = etree.fromstring(content, parser, base_url=schema_file)
+        return etree.XMLSchema(etree.ElementTree(root))
+    return etree.XMLSchema(etree.parse(schema_file, parser))
+
+
+def _issues(error_log):
+    return [ValidationIssue(ee.line, ee.column, ee.type_name, ee.message, ee.path) for ee in error_log]
+
+
+def validate(caaml, schema=None):
+    """Validate a CAAML document.
+
+    :param caaml: A `path-like object`_ of a CAAML file, a (text or binary)
+           stream such as the one :func:`snowmicropyn.serialize.caaml.export`
+           wrote to, the XML as bytes, or an ``xml.etree.ElementTree`` or
+           ``lxml`` tree or element.
+    :param schema: Compiled schema, by default the one of :func:`load_schema`.
+    :return: List of :data:`ValidationIssue`, empty if the document is valid.
+
+    .. _path-like object: https://docs.python.org/3/glossary.html#term-path-like-object
+    """
+    if schema is None:
+        schema = load_schema()
+    if isinstance(caaml, ET.ElementTree):
+        caaml = caaml.getroot()
+    if isinstance(caaml, ET.Element): # standard library tree, serialize it for lxml
+        caaml = ET.tostring(caaml, encoding='UTF-8')
+    elif hasattr(caaml, 'read'):
+        if hasattr(caaml, 'seek'):
+            caaml.seek(0)
+        caaml = caaml.read()
+        if isinstance(caaml, str):
+            caaml = caaml.encode('UTF-8')
+
+    parser = etree.XMLParser() # own parser for an error log of this document only
+    try:
+        if isinstance(caaml, bytes):
+            doc = etree.parse(io.BytesIO(caaml), parser)
+        elif isinstance(caaml, (etree._ElementTree, etree._Element)):
+            doc = caaml
+        else:
+            doc = etree.parse(str(caaml), parser)
+    except etree.XMLSyntaxError as e: # not even well-formed
+        return _issues(parser.error_log) or [ValidationIssue(*e.position, 'XMLSyntaxError', str(e), None)]
+    if schema.validate(doc):
+        return []
+    return _issues(schema.error_log)
+
+
+def _init_validation_worker(schema_file, schema_folder):
+    """Compile the schema once when the worker process starts."""
+    load_schema(schema_file, schema_folder)
+
+
+def _validate_file(caaml_file, schema_file=None, schema_folder=None):
+    """Validate a single file and report what happened."""
+    start = time.perf_counter()
+    try:
+        issues = validate(caaml_file, load_schema(schema_file, schema_folder))
+    except OSError as e: # e. g. missing file
+        issues = [ValidationIssue(None, None, type(e).__name__, str(e), None)]
+    return {'file': str(caaml_file), 'valid': not issues, 'issues': issues,
+        'seconds': time.perf_counter() - start}
+
+
+def validate_files(caaml_files, workers=None, schema_file=None, schema_folder=None):
+    """Validate many CAAML files with a pool of worker processes.
+
+    :param caaml_files: Folder to search for CAAML files (including subfolders),
+           a single CAAML file or an iterable of `path-like objects`_.
+    :param workers: Number of worker processes. ``None`` uses the number of
+           processors, ``1`` validates the files in the current process.
+    :param schema_file: Schema to validate against, see :func:`load_schema`.
+    :param schema_folder: Folder for downloaded schemas, see :func:`load_schema`.
+    :return: Pandas dataframe with one row per file and the columns 'file',
+             'valid', 'issues' (list of :data:`ValidationIssue`) and 'seconds'.
+             Use ``explode('issues')`` to get one row per issue.
+
+    .. _path-like objects: https://docs.python.org/3/glossary.html#term-path-like-object
+    """
+    if isinstance(caaml_files, (str, os.PathLike)):
+        path = pathlib.Path(caaml_files)
+        if path.is_dir():
+            files = sorted(ff for ff in path.rglob('*') if ff.suffix.lower() == '.caaml')
+        else:
+            files = [path]
+    else:
+        files = [pathlib.Path(ff) for ff in caaml_files]
+    log.info('Validating {} CAAML files'.format(len(files)))
+    # Download (if necessary) before the workers start, so that they find all schemas locally
+    load_schema(schema_file, schema_folder)
+    if workers == 1 or len(files) < 2:
+        results = [_validate_file(ff, schema_file, schema_folder) for ff in files]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_validation_worker,
+                initargs=(schema_file, schema_folder)) as pool:
+            chunksize = max(1, len(files) // (4 * (workers or os.cpu_count() or 1)))
+            results = list(pool.map(_validate_file, files, [schema_file] * len(files),
+                [schema_folder] * len(files), chunksize=chunksize))
+    return pd.DataFrame(results, columns=_VALIDATION_COLUMNS)
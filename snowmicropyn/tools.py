@@ -1,3 +1,5 @@
+import functools
+
 import numpy as np
 
 def downsample(x, n=2):
@@ -8,6 +10,128 @@ def downsample(x, n=2):
     x = x[:len(x) - i].reshape(-1, n).mean(axis=1)
     return x
 
+def _minmax_indices(y, n_out):
+    """Indices of the first, last and per-bucket extreme values of y (sorted)."""
+    n_out = max(n_out, 4)
+    n = len(y)
+    if n <= n_out:
+        return np.arange(n)
+    inner = n - 2
+    size = -(-inner // max((n_out - 2) // 2, 1)) # ceil
+    buckets = -(-inner // size)
+    # Pad with the last value, argmin/argmax return the first occurrence of an extreme
+    y_inner = np.pad(y[1:-1], (0, buckets * size - inner), mode='edge').reshape(buckets, size)
+    offset = 1 + np.arange(buckets) * size
+    idx = np.concatenate([[0], offset + np.argmin(y_inner, axis=1), offset + np.argmax(y_inner, axis=1), [n - 1]])
+    return np.unique(np.minimum(idx, n - 1))
+
+def _lttb_indices(x, y, n_out):
+    """Indices selected by Largest-Triangle-Three-Buckets (sorted)."""
+    n = len(x)
+    if n <= max(n_out, 2):
+        return np.arange(n)
+    if n_out < 3:
+        return np.array([0, n - 1])
+    # Bucket boundaries for all points except the first and the last one
+    edges = 1 + np.arange(n_out - 1) * (n - 2) // (n_out - 2)
+    counts = np.diff(edges)
+    avg_x = np.append(np.add.reduceat(x[1:-1], edges[:-1] - 1) / counts, x[-1])
+    avg_y = np.append(np.add.reduceat(y[1:-1], edges[:-1] - 1) / counts, y[-1])
+
+    selected = np.empty(n_out, dtype=int)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for ii in range(n_out - 2):
+        lo, hi = edges[ii], edges[ii + 1]
+        # Twice the area of the triangles formed with the previously selected
+        # point and the average of the next bucket
+        area = np.abs((x[a] - avg_x[ii + 1]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y[ii + 1] - y[a]))
+        a = lo + np.argmax(area)
+        selected[ii + 1] = a
+    return selected
+
+def decimate_minmax(x, y, n_out=5000):
+    """Reduce a signal to at most n_out points by keeping the minimum and
+    maximum of equally sized buckets.
+
+    Unlike :func:`downsample`, peaks survive, so that a plot of the result
+    looks the same as the one of the full signal as long as there are at
+    least two points per pixel. First and last point are always kept.
+
+    :param x: Array of x values (e. g. distance), sorted.
+    :param y: Array of y values (e. g. force) of the same length.
+    :param n_out: Maximal number of points to return (at least 4).
+    :return: Tuple (x, y) of numpy arrays.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    idx = _minmax_indices(y, n_out)
+    return x[idx], y[idx]
+
+def decimate_lttb(x, y, n_out=5000, preselect=4):
+    """Reduce a signal to at most n_out points with the
+    Largest-Triangle-Three-Buckets algorithm.
+
+    See `Downsampling Time Series for Visual Representation
+    <http://hdl.handle.net/1946/15343>`_ by Sveinn Steinarsson, 2013. LTTB
+    yields a visually more faithful line than :func:`decimate_minmax` with the
+    same number of points. To keep it fast on long signals, candidates are
+    preselected with :func:`decimate_minmax` (MinMaxLTTB). First and last
+    point as well as the global minimum and maximum are always kept.
+
+    :param x: Array of x values (e. g. distance), sorted.
+    :param y: Array of y values (e. g. force) of the same length.
+    :param n_out: Maximal number of points to return (at least 4).
+    :param preselect: Number of min/max candidates per output point. Use 0 to
+           run LTTB on the full signal.
+    :return: Tuple (x, y) of numpy arrays.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n_out = max(n_out, 4)
+    idx = np.arange(len(x))
+    if preselect and len(x) > preselect * n_out:
+        idx = _minmax_indices(y, preselect * n_out)
+    # Leave room for the global extrema, LTTB does not necessarily select them
+    idx = idx[_lttb_indices(x[idx].astype(float), y[idx].astype(float), n_out - 2)]
+    if len(y):
+        idx = np.unique(np.concatenate([idx, [np.argmin(y), np.argmax(y)]]))
+    return x[idx], y[idx]
+
+#: Kernels at least this long are convolved by overlap-add (FFT) instead of directly.
+SMOOTH_FFT_THRESHOLD = 400
+
+_smooth_windows = ['flat', 'hanning', 'hamming', 'bartlett', 'blackman']
+
+@functools.lru_cache(maxsize=32)
+def _smooth_kernel(window_len, window):
+    """Normalized smoothing kernel (cached, read-only)."""
+    w = getattr(np, window)(window_len)
+    w = w / w.sum()
+    w.setflags(write=False)
+    return w
+
+def _smooth_rows(x, window_len, window):
+    """Smooth each row of a 2D array, see :func:`smooth`."""
+    # Reflect the signal at both ends
+    s = np.concatenate([x[:, window_len - 1:0:-1], x, x[:, -1:-window_len:-1]], axis=1)
+
+    if window == 'flat': # moving average by running sums in O(n)
+        csum = np.cumsum(s, axis=1)
+        csum = np.concatenate([np.zeros((s.shape[0], 1)), csum], axis=1)
+        return (csum[:, window_len:] - csum[:, :-window_len]) / window_len
+
+    w = _smooth_kernel(window_len, window)
+    if window_len >= SMOOTH_FFT_THRESHOLD:
+        from scipy.signal import oaconvolve # importing scipy.signal is slow, only do it when needed
+        return oaconvolve(s, w[np.newaxis, :], mode='valid', axes=1)
+    return np.stack([np.convolve(w, row, mode='valid') for row in s])
+
+def _check_window(window):
+    if window not in _smooth_windows:
+        raise ValueError('Invalid value for parameter window. Valid values: ' + ','.join(_smooth_windows))
+
 def smooth(x, window_len=11, window='hanning'):
     """Smooth the data using a window with requested size"""
 
@@ -17,20 +141,21 @@ def smooth(x, window_len=11, window='hanning'):
         raise ValueError('Input vector needs to be bigger than window size.')
     if window_len < 3:
         return x
-    valid = ['flat', 'hanning', 'hamming', 'bartlett', 'blackman']
-    if window not in valid:
-        raise ValueError('Invalid value for parameter window. Valid values: ' + ','.join(valid))
-
-    s = np.r_[x[window_len - 1:0:-1], x, x[-1:-window_len:-1]]
+    _check_window(window)
+    return _smooth_rows(x[np.newaxis, :].astype(float), window_len, window)[0]
 
-    if window == 'flat':
-        # moving average
-        w = np.ones(window_len, 'd')
-    else:
-        w = eval('np.' + window + '(window_len)')
+def smooth_many(x, window_len=11, window='hanning'):
+    """Smooth each row of a 2D array (e. g. a stack of profiles of equal length)
+    the same way as :func:`smooth` does with a single signal."""
 
-    y = np.convolve(w / w.sum(), s, mode='valid')
-    return y
+    if x.ndim != 2:
+        raise ValueError('Function only accepts 2 dimension arrays.')
+    if x.shape[1] < window_len:
+        raise ValueError('Input vectors need to be bigger than window size.')
+    if window_len < 3:
+        return x
+    _check_window(window)
+    return _smooth_rows(x.astype(float), window_len, window)
 
 
 def lin_fit(x, y):
@@ -40,3 +165,42 @@ def lin_fit(x, y):
     std = np.std(y - y_fit)
 
     return x, y_fit, m, c, std
+
+class RunningLinFit:
+    """Linear least squares fits over arbitrary index ranges of a signal.
+
+    Running sums of x, y, x², xy and y² are calculated once, after which the
+    fit for any range ``[begin, end)`` takes constant time. It yields the same
+    slope, intercept and residual standard deviation as :func:`lin_fit`.
+    """
+
+    def __init__(self, x, y):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        # Shift to the mean to keep the sums well conditioned
+        self._x0 = x.mean() if x.size else 0.
+        self._y0 = y.mean() if y.size else 0.
+        x = x - self._x0
+        y = y - self._y0
+        self._sums = [np.concatenate([[0.], np.cumsum(vv)]) for vv in (x, y, x * x, x * y, y * y)]
+
+    def fit(self, begin, end):
+        """Fit lines to the index ranges ``[begin, end)``.
+
+        :param begin: First index of the range(s), int or array of ints.
+        :param end: End index (exclusive) of the range(s), int or array of ints.
+        :return: Tuple (slope, intercept, std) of floats or numpy arrays. Ranges
+                 with less than two values yield nan.
+        """
+        begin = np.asarray(begin)
+        end = np.asarray(end)
+        nn = (end - begin).astype(float)
+        s_x, s_y, s_xx, s_xy, s_yy = [ss[end] - ss[begin] for ss in self._sums]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            var_x = s_xx - s_x ** 2 / nn
+            cov_xy = s_xy - s_x * s_y / nn
+            var_y = s_yy - s_y ** 2 / nn
+            m = np.where(nn >= 2, cov_xy / var_x, np.nan)
+            c = (s_y - m * s_x) / nn + self._y0 - m * self._x0
+            std = np.sqrt(np.maximum(var_y - m * cov_xy, 0) / nn)
+        return m, c, std
@@ -29,3 +29,35 @@ def chunkup(samples, window, overlap):
 
         center = center + step
     return chunks
+
+def chunk_bounds(samples, window, overlap):
+    """Index bounds of the chunks produced by :func:`chunkup`.
+
+    Instead of slicing the samples, this only determines where each chunk
+    begins and ends. The distance column must be sorted (which it always is
+    for SMP recordings), so the bounds are found with a binary search.
+
+    :param samples: SMP samples
+    :param window: size of moving window in mm
+    :param overlap: overlap factor in percent
+    :return: Tuple of numpy arrays (centers, starts, stops). Chunk ``i``
+             consists of the sample rows ``starts[i]:stops[i]``.
+    """
+    if not 0 <= overlap < 100:
+        raise ValueError('overlap value {} invalid, must be a value >= 0 and < 100 [%]'.format(overlap))
+
+    distance = samples.distance.values
+    first = distance[0] if len(distance) > 0 else 0
+    last = distance[-1] if len(distance) > 0 else 0
+
+    step = window - (window * overlap / 100)
+    center = first
+    centers = []
+    while center < last: # same stepping as chunkup() to get identical centers
+        centers.append(center)
+        center = center + step
+    centers = np.asarray(centers, dtype=float)
+
+    starts = np.searchsorted(distance, centers - window / 2., side='left')
+    stops = np.searchsorted(distance, centers + window / 2., side='left')
+    return centers, starts, stops
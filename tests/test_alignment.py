@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# Unit test for banded dynamic time warping, layer matching with it and parsing of manual profiles
+
+import os
+import pathlib
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+from snowmicropyn import alignment
+from snowmicropyn.match import match_layers_dtw
+from snowmicropyn.serialize.caaml import _hardness_identifier_to_index, parse_grainshape, parse_grainshapes
+
+def full_dtw(x, y, mask):
+    # Textbook implementation for comparison
+    nn, mm = len(x), len(y)
+    acc = np.full((nn + 1, mm + 1), np.inf)
+    acc[0, 0] = 0
+    for ii in range(nn):
+        for jj in range(mm):
+            if mask[ii, jj]:
+                acc[ii + 1, jj + 1] = abs(x[ii] - y[jj]) + min(acc[ii, jj], acc[ii, jj + 1], acc[ii + 1, jj])
+    return acc[nn, mm]
+
+rng = np.random.default_rng(42)
+for nn, mm, band in [(30, 30, 3), (20, 35, 5), (35, 12, 2), (25, 25, 100), (1, 8, 1)]:
+    xx = rng.normal(size=nn)
+    yy = rng.normal(size=mm)
+    path, cost = alignment.banded_dtw(xx, yy, band)
+    steps = np.diff(path, axis=0)
+    assert tuple(path[0]) == (0, 0) and tuple(path[-1]) == (nn - 1, mm - 1)
+    assert np.all((steps >= 0) & (steps <= 1)) and np.all(steps.sum(axis=1) >= 1)
+    np.testing.assert_allclose(cost, np.abs(xx[path[:, 0]] - yy[path[:, 1]]).sum())
+    width = min(2 * max(band, int(np.ceil((mm - 1) / max(nn - 1, 1))) + 1) + 1, mm)
+    mask = np.zeros((nn, mm), dtype=bool)
+    for ii, start in enumerate(alignment._band_starts(nn, mm, width, (mm - 1) / max(nn - 1, 1))):
+        mask[ii, start:start + width] = True
+    np.testing.assert_allclose(cost, full_dtw(xx, yy, mask))
+
+# A settled SMP profile is matched with the manual layers:
+shapes = pd.DataFrame({'depthTop': [0, 80, 110, 230, 245], 'thickness': [80, 30, 120, 15, 300],
+    'grainFormPrimary': ['PP', 'DF', 'RG', 'MF', 'FC'], 'hardness': ['F', '4F', '1F', 'P', '4F+']})
+depth = np.arange(0, 450, 1.25)
+manual_depth = depth / 0.9
+layer = np.searchsorted(shapes.depthTop, manual_depth, side='right') - 1
+hardness = np.array([_hardness_identifier_to_index(hh) for hh in shapes.hardness])[layer]
+aa, bb = 2.780171583411649, 0.341486204481987 # see _get_hardness_fit
+samples = pd.DataFrame({'distance': depth + 20, 'force_median': (hardness / aa) ** (1 / bb)})
+matched = match_layers_dtw(samples, shapes, surface=20, band=100)
+accuracy = (matched.grain_shape.to_numpy() == shapes.grainFormPrimary.to_numpy()[layer]).mean()
+assert accuracy > 0.98, accuracy
+
+# The manual layers are read back from a CAAML file (with mixed length units):
+layer_xml = ''.join(f'<caaml:Layer><caaml:depthTop uom="cm">{top / 10}</caaml:depthTop>'
+    f'<caaml:thickness uom="mm">{thick}</caaml:thickness><caaml:grainFormPrimary>{shape}</caaml:grainFormPrimary>'
+    f'<caaml:hardness uom="">{hard}</caaml:hardness></caaml:Layer>' for top, thick, shape, hard in shapes.itertuples(index=False))
+with tempfile.TemporaryDirectory() as folder:
+    with open(os.path.join(folder, 'manual.caaml'), 'w') as ff:
+        ff.write('<?xml version="1.0" encoding="UTF-8"?><caaml:SnowProfile '
+            'xmlns:caaml="http://caaml.org/Schemas/SnowProfileIACS/v6.0.3"><caaml:snowProfileResultsOf>'
+            '<caaml:SnowProfileMeasurements><caaml:stratProfile>' + layer_xml + '</caaml:stratProfile>'
+            '<caaml:densityProfile><caaml:Layer><caaml:depthTop uom="cm">0</caaml:depthTop></caaml:Layer>'
+            '</caaml:densityProfile></caaml:SnowProfileMeasurements></caaml:snowProfileResultsOf></caaml:SnowProfile>')
+    parsed = parse_grainshape(os.path.join(folder, 'manual.caaml'), unit='mm')
+    assert parsed.grainFormPrimary.dtype == 'category'
+    pd.testing.assert_frame_equal(parsed.astype({'grainFormPrimary': object}), shapes.astype({'depthTop': float,
+        'thickness': float}), check_dtype=False)
+    file = pathlib.Path(folder) / 'manual.caaml'
+    shutil.copy(file, pathlib.Path(folder) / 'copy.caaml')
+    for source, expected in [(folder, ['copy.caaml', 'manual.caaml']), (file, ['manual.caaml']),
+            (str(file), ['manual.caaml']), ([str(file), pathlib.Path(folder) / 'copy.caaml'], ['manual.caaml', 'copy.caaml'])]:
+        bulk = parse_grainshapes(source, unit='mm')
+        assert [ff.name for ff in bulk] == expected, (source, list(bulk))
+        assert all(layers.equals(parsed) for layers in bulk.values())
@@ -1,17 +1,13 @@
 #!/usr/bin/env python3
 # Unit test for CAAML output: validation against its schema
 
-from lxml import etree
-import os
-import requests
+import io
+
+import numpy as np
 import snowmicropyn as smp
+from snowmicropyn import loewe2012
 from snowmicropyn.pyngui.document import Document
-
-def validate(xml_file: str, xsd_file: str):
-    xml_doc = etree.parse(xml_file)
-    schema_doc = etree.parse(xsd_file)
-    schema = etree.XMLSchema(schema_doc)
-    schema.assertValid(xml_doc)
+from snowmicropyn.serialize import caaml, validation
 
 if __name__ == "__main__":
     pro = smp.Profile.load('../examples/profiles/S37M0876.pnt')
@@ -21,8 +17,27 @@ if __name__ == "__main__":
     export_settings['remove_negative_data'] = True
     doc.export_caaml(testfile, export_settings=export_settings)
 
-    xsd_file = "./CAAMLv6_SnowProfileIACS.xsd"
-    if not os.path.exists(xsd_file):
-        res = requests.get(f"http://caaml.org/Schemas/SnowProfileIACS/v6.0.3/{xsd_file}")
-        open(xsd_file, "wb").write(res.content)
-    validate(testfile, xsd_file)
+    # Grain shapes are filtered together with their rows:
+    param = smp.params['P2015']
+    loewe2012_df = loewe2012.calc(pro.samples_within_snowpack(), param.window_size, param.overlap)
+    derivatives = loewe2012_df.merge(param.calc_from_loewe2012(loewe2012_df))
+    derivatives.loc[[10, 11, 200], 'force_median'] = -1
+    shapes = np.array(['RG', 'FC', 'DH', 'PP'])[np.arange(len(derivatives)) % 4]
+    stream = io.StringIO()
+    caaml.export(export_settings, derivatives, shapes, 'test', pro._timestamp, pro._smp_serial,
+        pro._longitude, pro._latitude, pro._altitude, stream)
+    stream.seek(0)
+    layers = caaml.parse_grainshape(stream)
+    kept = (derivatives >= 0).all(axis=1).to_numpy()
+    assert not kept[[10, 11, 200]].any() and list(layers.grainFormPrimary) == list(shapes[kept])
+    try:
+        caaml.export(export_settings, derivatives, shapes[1:], 'test', pro._timestamp, pro._smp_serial,
+            pro._longitude, pro._latitude, pro._altitude, io.StringIO())
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('Grain shapes of the wrong length must not be accepted')
+
+    # The schema is downloaded on the first run only
+    issues = validation.validate(testfile, validation.load_schema(schema_folder='./schemas'))
+    assert not issues, issues
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# Unit test for the grain shape classifier compiled to plain NumPy
+
+import pathlib
+import shutil
+import tempfile
+
+import numpy as np
+import snowmicropyn as smp
+from snowmicropyn import loewe2012
+from snowmicropyn.ai.grain_classifier import grain_classifier
+from snowmicropyn.ai.numpy_predictor import NumpyPredictor
+
+# Synthetic training data: the example profile with differently placed layer markers
+layers = [{'rg1': 100, 'fc2': 300, 'dh3': 600}, {'pp1': 80, 'rg2': 250, 'fc3': 500}, {'df1': 90, 'rg2': 400}]
+
+with tempfile.TemporaryDirectory() as folder:
+    folder = pathlib.Path(folder)
+    for ii, markers in enumerate(layers):
+        pnt = folder / f'P{ii}.pnt'
+        shutil.copy('../examples/profiles/S37M0876.pnt', pnt)
+        pro = smp.Profile.load(str(pnt))
+        for label, value in markers.items():
+            pro.set_marker(label, value)
+        pro.set_marker('ground', 800)
+        pro.save()
+
+    pro = smp.Profile.load('../examples/profiles/S37M0876.pnt')
+    samples = loewe2012.calc(pro.samples, 2.5, 50)
+    rng = np.random.default_rng(0)
+    features = ['force_median', 'L2012_lambda', 'L2012_f0', 'L2012_delta', 'L2012_L']
+    noisy = samples.copy()
+    noisy[features] *= rng.lognormal(0, 0.3, size=(len(noisy), len(features)))
+
+    configurations = [('standard', 'svc'), ('minmax', 'svc'), ('standard', 'gaussiannb'),
+        ('minmax', 'gaussiannb'), ('minmax', 'multinomialnb'), ('standard', 'lr'), ('minmax', 'lr')]
+    for scaler, model in configurations:
+        settings = {'training_data_folder': str(folder), 'training_data_method': 'markers',
+            'training_cache': False, 'scaler': scaler, 'model': model, 'model_svc_gamma': 1,
+            'remove_negative_data': True}
+        classifier = grain_classifier(settings)
+        predictor = classifier.compile()
+        for data in (samples, noisy):
+            expected = classifier.predict(data)
+            np.testing.assert_array_equal(predictor.predict(data), expected, err_msg=f'{scaler} {model}')
+
+        # The saved predictor predicts the same:
+        npz = folder / f'{scaler}_{model}.npz'
+        predictor.save(npz)
+        loaded = NumpyPredictor.load(npz)
+        assert (loaded.scaler, loaded.model, loaded.features, loaded.settings) == \
+            (predictor.scaler, predictor.model, predictor.features, predictor.settings)
+        np.testing.assert_array_equal(loaded.predict(noisy), predictor.predict(noisy))
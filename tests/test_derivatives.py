@@ -25,3 +25,31 @@ cr2020_ref = pd.read_csv(fcr_ref)
 pd.testing.assert_frame_equal(p2015, p2015_ref, atol=1e-6)
 pd.testing.assert_frame_equal(cr2020, cr2020_ref, atol=1e-6)
 
+
+# The vectorized shot noise step must reproduce the per-window calculation:
+import numpy as np
+from snowmicropyn import loewe2012
+from snowmicropyn.windowing import chunk_bounds
+
+samples = pro.samples
+p2015_param = smp.params['P2015']
+sn = loewe2012.calc(samples, p2015_param.window_size, p2015_param.overlap)
+_, starts, stops = chunk_bounds(samples, p2015_param.window_size, p2015_param.overlap)
+spatial_res = np.median(np.diff(samples.distance.values))
+batched = np.array([loewe2012.calc_step_batch(spatial_res, samples.force.values[aa:bb])
+    for aa, bb in zip(starts, stops)])
+cols = ['L2012_lambda', 'L2012_f0', 'L2012_delta', 'L2012_L']
+np.testing.assert_allclose(batched, sn[cols].values, rtol=1e-9)
+
+# Bootstrapped bands keep the point estimates untouched:
+p2015_boot = p2015_param.calc_bootstrap(samples, resamples=20, seed=0)
+pd.testing.assert_frame_equal(p2015_boot[p2015.columns], p2015_ref, atol=1e-6)
+
+# ... and the point estimates lie within their bands (the bands are not biased):
+within_snowpack = pro.samples_within_snowpack()
+for name in ('P2015', 'CR2020'):
+    boot = smp.params[name].calc_bootstrap(within_snowpack, resamples=50, seed=1)
+    for quantity in ('_density', '_ssa'):
+        value = boot[name + quantity]
+        inside = (value >= boot[name + quantity + '_lower']) & (value <= boot[name + quantity + '_upper'])
+        assert inside.mean() > 0.9, (name, quantity, inside.mean())
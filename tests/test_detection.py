@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# Unit test for surface and ground detection against the original loop implementations
+
+import numpy as np
+from types import SimpleNamespace
+import snowmicropyn as smp
+from snowmicropyn import detection
+from snowmicropyn.tools import downsample, smooth
+
+def reference_surface(profile):
+    distance = profile.samples.distance.values[250:]
+    force = profile.samples.force.values[250:]
+    force = downsample(force, 20)
+    distance = downsample(distance, 20)
+    force = smooth(force, 242)
+    y_grad = np.gradient(force)
+    y_grad = downsample(y_grad, 3)
+    x_grad = downsample(distance, 3)
+    max_force = np.amax(force)
+    for i in np.arange(100, x_grad.size):
+        std = np.std(y_grad[:i - 1])
+        mean = np.mean(y_grad[:i - 1])
+        if y_grad[i] >= 5 * std + mean:
+            surface = x_grad[i]
+            break
+    if i == x_grad.size - 1:
+        surface = max_force
+    return surface
+
+def reference_ground(profile):
+    force = profile.samples.force
+    distance = profile.samples.distance
+    ground = distance.iloc[-1]
+    if force.max() >= profile.overload:
+        i_ol = force.argmax()
+        i_threshhold = np.where(distance.values >= distance.values[i_ol] - 20)[0][0]
+        f_mean = np.mean(force.iloc[0:i_threshhold])
+        f_std = np.std(force.iloc[0:i_threshhold])
+        threshhold = f_mean + 5 * f_std
+        while force.iloc[i_ol] > threshhold:
+            i_ol -= 10
+        ground = distance.iloc[i_ol]
+    return ground
+
+pro = smp.Profile.load('../examples/profiles/S37M0876.pnt')
+# Some variations of the example profile: cut air gap, cut bottom, only the air gap
+profiles = [pro]
+for begin, end in [(5000, None), (20000, 150000), (0, 60000), (0, 20000)]:
+    samples = pro.samples.iloc[begin:end].reset_index(drop=True)
+    profiles.append(SimpleNamespace(samples=samples, overload=pro.overload))
+# Low overload values to trigger the search for the ground
+for overload in [10, 1, 0.5]:
+    profiles.append(SimpleNamespace(samples=pro.samples, overload=overload))
+
+reference = [reference_surface(pp) for pp in profiles]
+assert [detection.detect_surface(pp) for pp in profiles] == reference
+assert detection.detect_surfaces(profiles) == reference
+
+reference = [reference_ground(pp) for pp in profiles]
+assert [detection.detect_ground(pp) for pp in profiles] == reference
+assert detection.detect_grounds(profiles) == reference
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# Unit test for drift, offset and noise calculation from running sums
+
+import numpy as np
+import snowmicropyn as smp
+from snowmicropyn.batch import drift_table
+from snowmicropyn.tools import lin_fit
+
+pro = smp.Profile.load('../examples/profiles/S37M0876.pnt')
+samples = pro.samples
+
+# Same result as a polynomial fit over the same range:
+ranges = [pro.drift_range(), (1, 70), (50, 20), (100, 800), (0, 821)]
+for begin, end in ranges:
+    lo, hi = min(begin, end), max(begin, end)
+    drift_range = samples[samples.distance.between(lo, hi)]
+    _, _, drift, offset, noise = lin_fit(drift_range.distance, drift_range.force)
+    np.testing.assert_allclose(pro.drift(begin, end), (drift, offset, noise), rtol=1e-6, atol=1e-12)
+
+# Many ranges in one call:
+begins, ends = np.array(ranges).T
+drifts, offsets, noises = pro.drift(begins, ends)
+for ii, (begin, end) in enumerate(ranges):
+    np.testing.assert_allclose((drifts[ii], offsets[ii], noises[ii]), pro.drift(begin, end))
+
+table = drift_table([pro, pro])
+assert len(table) == 2 and table.drift[0] == pro.drift()[0]
+
+# After correction, the fitted line is zero:
+pro.correct_drift()
+drift, offset, noise = pro.drift()
+np.testing.assert_allclose((drift, offset), (0, 0), atol=1e-9)
+np.testing.assert_allclose(noise, table.noise[0])
+
+# The corrected samples are exported, whether in this process or in workers:
+import pathlib
+import tempfile
+from snowmicropyn.batch import export_caaml
+
+with tempfile.TemporaryDirectory() as folder:
+    exported = []
+    for workers in (1, 2):
+        outfolder = pathlib.Path(folder) / str(workers)
+        outfolder.mkdir()
+        pro.set_marker('surface', 100) # unsaved, like the drift correction
+        summary = export_caaml([pro, pro], outfolder=outfolder, workers=workers)
+        assert (summary.status == 'exported').all(), summary.error
+        exported.append(pathlib.Path(summary.outfile[0]).read_bytes())
+    assert exported[0] == exported[1]
+    summary = export_caaml(['../examples/profiles/S37M0876.pnt'], outfolder=folder)
+    assert pathlib.Path(summary.outfile[0]).read_bytes() != exported[0] # the files differ
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# Unit test for layer segmentation by change point detection
+
+import numpy as np
+import pandas as pd
+from scipy.signal import lfilter
+
+from snowmicropyn import segmentation
+
+def correlated_noise(rng, n, scale, phi=0.95):
+    """Noise with neighbouring samples as strongly correlated as in SMP signals."""
+    white = rng.normal(0, scale * np.sqrt(1 - phi ** 2), n)
+    return lfilter([1], [1, -phi], white)
+
+spatial_res = 0.004 # [mm]
+distance = np.arange(0, 300, spatial_res)
+rng = np.random.default_rng(0)
+
+# Pure noise: no layers
+for trial in range(5):
+    samples = pd.DataFrame({'distance': distance, 'force': 0.5 + correlated_noise(rng, len(distance), 0.05)})
+    boundaries = segmentation.segment_samples(samples)
+    assert len(boundaries) == 0, boundaries
+
+# Piecewise constant force (with noise growing with the force, as in snow)
+truth = np.array([60, 150, 220]) # [mm]
+levels = np.array([0.1, 0.5, 0.2, 1.0]) # [N]
+level = levels[np.searchsorted(truth, distance, side='right')]
+samples = pd.DataFrame({'distance': distance, 'force': level + correlated_noise(rng, len(distance), 0.2) * level})
+for min_thickness in (1, 5, 20):
+    boundaries = segmentation.segment_samples(samples, min_thickness=min_thickness)
+    assert len(boundaries) == len(truth), (min_thickness, boundaries)
+    np.testing.assert_allclose(boundaries, truth, atol=1)
+
+# Short segments of a plain signal, change points between samples
+signal = np.concatenate([rng.normal(0, 1, 50), rng.normal(5, 1, 30), rng.normal(0, 3, 40)])
+np.testing.assert_array_equal(segmentation.pelt(signal, min_size=5), [50, 80])
+assert len(segmentation.pelt(rng.normal(0, 1, 500))) == 0
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# Unit test for smoothing and decimation tools
+
+import numpy as np
+from snowmicropyn import tools
+
+def reference_smooth(x, window_len, window):
+    """Smoothing as it was implemented originally (direct convolution of each row)."""
+    s = np.r_[x[window_len - 1:0:-1], x, x[-1:-window_len:-1]]
+    w = np.ones(window_len, 'd') if window == 'flat' else getattr(np, window)(window_len)
+    return np.convolve(w / w.sum(), s, mode='valid')
+
+rng = np.random.default_rng(0)
+stack = rng.normal(size=(3, 2000)).cumsum(axis=1)
+
+# Direct, running sum and overlap-add (FFT) paths give the old result:
+for window_len in (3, 11, 242, tools.SMOOTH_FFT_THRESHOLD, 1001):
+    for window in ('flat', 'hanning', 'hamming', 'bartlett', 'blackman'):
+        expected = np.stack([reference_smooth(row, window_len, window) for row in stack])
+        np.testing.assert_allclose(tools.smooth_many(stack, window_len, window), expected, atol=1e-9)
+        np.testing.assert_allclose(tools.smooth(stack[0], window_len, window), expected[0], atol=1e-9)
+
+row = stack[0]
+assert tools.smooth(row, 2) is row # too short a window to smooth
+for bad in (lambda: tools.smooth(stack), lambda: tools.smooth_many(stack[0]),
+        lambda: tools.smooth(stack[0], 5001), lambda: tools.smooth(stack[0], 11, 'kaiser')):
+    try:
+        bad()
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('ValueError expected')
+
+# Decimation keeps the endpoints and global extrema within n_out points:
+import snowmicropyn as smp
+pro = smp.Profile.load('../examples/profiles/S37M0876.pnt')
+signals = [(pro.samples.distance.values, pro.samples.force.values)]
+for n in (10, 1001, 50000):
+    x = np.sort(rng.uniform(0, 100, n))
+    signals.append((x, rng.normal(size=n) * rng.uniform(0.1, 10, n)))
+for x, y in signals:
+    for n_out in (4, 5, 100, 5000):
+        for decimate in (tools.decimate_minmax, tools.decimate_lttb):
+            xd, yd = decimate(x, y, n_out)
+            assert len(xd) == len(yd) <= max(n_out, 4), (decimate.__name__, n_out, len(xd))
+            assert xd[0] == x[0] and xd[-1] == x[-1] and yd[0] == y[0] and yd[-1] == y[-1]
+            assert np.all(np.diff(xd) >= 0) and np.isin(xd, x).all()
+            assert yd.max() == y.max() and yd.min() == y.min(), (decimate.__name__, n_out, len(x))
+    # Nothing to reduce:
+    xd, yd = tools.decimate_minmax(x, y, len(x))
+    np.testing.assert_array_equal(xd, x)
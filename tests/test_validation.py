@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# Unit test for CAAML validation with a small offline schema
+
+import io
+import os
+import tempfile
+import xml.etree.ElementTree as ET
+
+from snowmicropyn.serialize import validation
+
+MAIN_XSD = '''<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" xmlns:b="urn:b" xmlns="urn:a"
+    targetNamespace="urn:a" elementFormDefault="qualified">
+  <xs:import namespace="urn:b" schemaLocation="http://example.invalid/b/b.xsd"/>
+  <xs:element name="root"><xs:complexType><xs:sequence>
+    <xs:element name="depth" type="xs:double"/><xs:element ref="b:thing"/>
+  </xs:sequence></xs:complexType></xs:element>
+</xs:schema>'''
+# Imported from the web, includes a sibling file by a relative location:
+B_XSD = '''<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" targetNamespace="urn:b" elementFormDefault="qualified">
+  <xs:include schemaLocation="c.xsd"/>
+</xs:schema>'''
+C_XSD = '''<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" targetNamespace="urn:b" elementFormDefault="qualified">
+  <xs:element name="thing" type="xs:positiveInteger"/>
+</xs:schema>'''
+
+def document(depth, thing):
+    return f"<root xmlns='urn:a' xmlns:b='urn:b'><depth>{depth}</depth><b:thing>{thing}</b:thing></root>"
+
+def write(file, content):
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    with open(file, 'w') as ff:
+        ff.write(content)
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as folder:
+        schema_file = os.path.join(folder, 'main.xsd')
+        schema_folder = os.path.join(folder, 'schemas')
+        write(schema_file, MAIN_XSD)
+        # Already downloaded schemas are used without network access
+        write(os.path.join(schema_folder, 'example.invalid', 'b', 'b.xsd'), B_XSD)
+        write(os.path.join(schema_folder, 'example.invalid', 'b', 'c.xsd'), C_XSD)
+        schema = validation.load_schema(schema_file, schema_folder)
+        assert validation.load_schema(schema_file, schema_folder) is schema # compiled once
+
+        assert validation.validate(io.StringIO(document(1.5, 3)), schema) == []
+        assert validation.validate(ET.ElementTree(ET.fromstring(document(1.5, 3))), schema) == []
+        issues = validation.validate(document('x', -1).encode(), schema)
+        assert [ii.type for ii in issues] == ['SCHEMAV_CVC_DATATYPE_VALID_1_2_1'] * 2, issues
+        issues = validation.validate(b'<root><depth>', schema)
+        assert len(issues) > 0 and issues[0].path is None, issues
+
+        files = [os.path.join(folder, 'caaml', f'{ii}.caaml') for ii in range(6)]
+        for ii, ff in enumerate(files):
+            write(ff, document(ii, ii if ii % 2 else ii + 1) if ii != 5 else '<root>')
+        for workers in (1, 2):
+            summary = validation.validate_files(os.path.join(folder, 'caaml'), workers, schema_file, schema_folder)
+            assert summary.file.tolist() == files
+            assert summary.valid.tolist() == [True] * 5 + [False], summary
+            assert len(summary.issues[5]) == 1 and summary.issues[5][0].line == 1, summary.issues[5]
+        summary = validation.validate_files(files[5], schema_file=schema_file, schema_folder=schema_folder)
+        assert summary.file.tolist() == files[5:] and not summary.valid[0]